@@ -0,0 +1,73 @@
+"""
+Requests per second with a small db pool: connections pinned for the whole
+request (as the dependencies used to do) versus taken per statement.
+Runs the app in process against services from the given config; the mix
+is anonymous /auth/me hits plus signed-in post list pages.
+
+    python -m benchmarks.connection_scope --config etc/config.json
+"""
+import argparse
+import asyncio
+import secrets
+import time
+
+import fastapi
+import httpx
+from asgi_lifespan import LifespanManager
+
+from misc import ctrl
+from misc.depends import db as db_depends
+from service import app as service_app
+
+POOL_SIZE = 4
+CONCURRENCY = 64
+DURATION = 5
+
+
+async def pinned_conn(request: fastapi.Request):
+    async with request.app.state.db_pool.acquire() as conn:
+        yield conn
+
+
+async def load(client: httpx.AsyncClient, token: str) -> int:
+    done = 0
+    deadline = time.monotonic() + DURATION
+    while time.monotonic() < deadline:
+        if done % 2:
+            response = await client.get('/api/v1/posts/', headers={'X-SID': token})
+        else:
+            response = await client.get('/api/v1/auth/me', headers={'X-SID': secrets.token_hex(24)})
+        response.raise_for_status()
+        done += 1
+    return done
+
+
+async def measure(config: dict, pinned: bool) -> float:
+    app = service_app.main(None, config)
+    if pinned:
+        # one override for both, so a request pins a single connection like before
+        app.dependency_overrides[db_depends.get] = pinned_conn
+        app.dependency_overrides[db_depends.get_read] = pinned_conn
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(app=app, base_url='http://bench') as client:
+            response = await client.post(
+                '/api/v1/auth/sign-up',
+                json={'name': f'bench_{secrets.token_hex(4)}', 'password': 'password'}
+            )
+            token = response.json()['data']['token']
+            start = time.monotonic()
+            done = sum(await asyncio.gather(*[load(client, token) for _ in range(CONCURRENCY)]))
+            return done / (time.monotonic() - start)
+
+
+def main(args, config: dict):
+    config['db'] = {**config['db'], 'min_size': POOL_SIZE, 'max_size': POOL_SIZE}
+    print(f'pool size {POOL_SIZE}, {CONCURRENCY} concurrent clients')
+    for name, pinned in (('pinned', True), ('lazy', False)):
+        print(f'{name:>8} {asyncio.run(measure(config, pinned)):>10.1f} rps')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', required=True, help='path to service config')
+    ctrl.main_with_parses(parser, main)
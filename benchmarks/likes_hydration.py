@@ -0,0 +1,71 @@
+"""
+Latency of filling likes for a page of posts: one redis call per post
+versus one pipelined call per page.
+
+    python -m benchmarks.likes_hydration --config etc/config.json
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from misc import ctrl, likes, redis
+
+PAGE_SIZES = [20, 100, 500]
+LIKERS = 50
+ROUNDS = 200
+FIRST_POST_ID = 10 ** 12
+USER_ID = 1
+
+
+def percentile(samples: list[float], p: float) -> float:
+    return statistics.quantiles(samples, n=100)[int(p) - 1]
+
+
+async def sequential(post_ids: list[int], conn: redis.Connection):
+    return [await likes.get_stats_many([i], USER_ID, conn, None) for i in post_ids]
+
+
+async def batched(post_ids: list[int], conn: redis.Connection):
+    return await likes.get_stats_many(post_ids, USER_ID, conn, None)
+
+
+async def measure(fetch, post_ids: list[int], conn: redis.Connection) -> list[float]:
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        await fetch(post_ids, conn)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def run(config: dict):
+    conn = await redis.init(config['redis'])
+    post_ids = list(range(FIRST_POST_ID, FIRST_POST_ID + max(PAGE_SIZES)))
+    try:
+        await redis.pipelined(
+            [
+                ('ZADD', likes.cache_key(i), 0, likes.LOADED,
+                 *[v for user_id in range(1, LIKERS + 1) for v in (user_id, user_id)])
+                for i in post_ids
+            ],
+            conn
+        )
+        print(f'{"page":>6} {"mode":>10} {"p50 ms":>8} {"p99 ms":>8}')
+        for size in PAGE_SIZES:
+            for name, fetch in (('sequential', sequential), ('pipeline', batched)):
+                samples = await measure(fetch, post_ids[:size], conn)
+                print(f'{size:>6} {name:>10} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}')
+    finally:
+        await conn.delete(*[likes.cache_key(i) for i in post_ids])
+        await redis.close(conn)
+
+
+def main(args, config: dict):
+    asyncio.run(run(config))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', required=True, help='path to service config')
+    ctrl.main_with_parses(parser, main)
@@ -0,0 +1,67 @@
+"""
+Time to turn result rows into Post models: validating parse_obj versus the
+trusted converter. Rows are plain dicts shaped like posts records, so it
+does not need any services.
+
+    python -m benchmarks.record_conversion
+"""
+import argparse
+import datetime
+import statistics
+import time
+
+from misc import db
+from models.posts import Post
+
+ROW_COUNTS = [20, 1000, 10000]
+ROUNDS = 50
+
+
+def percentile(samples: list[float], p: float) -> float:
+    return statistics.quantiles(samples, n=100)[int(p) - 1]
+
+
+def rows(count: int) -> list[dict]:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [
+        {
+            'id': i,
+            'title': f'post {i}',
+            'body': 'lorem ipsum dolor sit amet ' * 4,
+            'created_at': now,
+            'author_id': i % 100,
+        }
+        for i in range(count)
+    ]
+
+
+def validated(records: list[dict]) -> list[Post]:
+    return db.record_to_model_list(Post, records)
+
+
+def trusted(records: list[dict]) -> list[Post]:
+    return db.record_to_model_list(Post, records, trusted=True)
+
+
+def measure(convert, records: list[dict]) -> list[float]:
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        convert(records)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    print(f'{"rows":>6} {"mode":>10} {"p50 ms":>8} {"p99 ms":>8}')
+    for count in ROW_COUNTS:
+        records = rows(count)
+        assert validated(records) == trusted(records)
+        for name, convert in (('validated', validated), ('trusted', trusted)):
+            samples = measure(convert, records)
+            print(f'{count:>6} {name:>10} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}')
+
+
+if __name__ == '__main__':
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    main()
@@ -0,0 +1,93 @@
+"""
+Time to render a page of posts the way a route with a response_model does:
+fastapi.routing.serialize_response (validation against the response model
+and jsonable_encoder) followed by the response class, stdlib JSONResponse
+versus ORJSONResponse, and returned as a response built by
+misc.encoding.model_response, which skips both. Does not need any services.
+
+    python -m benchmarks.serialization
+"""
+import argparse
+import asyncio
+import datetime
+import statistics
+import time
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from misc import encoding
+from models.posts import Post, PostsListData, PostsListSuccessResponse
+
+PAGE_SIZES = [20, 100, 1000]
+ROUNDS = 200
+
+
+def percentile(samples: list[float], p: float) -> float:
+    return statistics.quantiles(samples, n=100)[int(p) - 1]
+
+
+def page(size: int) -> PostsListSuccessResponse:
+    now = datetime.datetime.now()
+    return PostsListSuccessResponse(data=PostsListData(
+        items=[
+            Post(
+                id=i,
+                title=f'post {i}',
+                body='lorem ipsum dolor sit amet ' * 4,
+                author_id=i % 100,
+                created_at=now,
+                likes_count=i,
+                liked_by_me=bool(i % 2)
+            )
+            for i in range(size)
+        ],
+        total=size,
+        limit=size,
+        page=1,
+        total_mode='exact',
+        next_cursor='eyJpZCI6IDF9'
+    ))
+
+
+async def endpoint():
+    ...
+
+
+# the cloned field FastAPI validates route results against
+FIELD = APIRoute('/', endpoint, response_model=PostsListSuccessResponse).secure_cloned_response_field
+
+
+async def stdlib(response: PostsListSuccessResponse) -> bytes:
+    return JSONResponse(await serialize_response(field=FIELD, response_content=response)).body
+
+
+async def orjson(response: PostsListSuccessResponse) -> bytes:
+    return ORJSONResponse(await serialize_response(field=FIELD, response_content=response)).body
+
+
+async def direct(response: PostsListSuccessResponse) -> bytes:
+    return encoding.model_response(response).body
+
+
+async def measure(render, response: PostsListSuccessResponse) -> list[float]:
+    samples = []
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        await render(response)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+async def main():
+    print(f'{"page":>6} {"mode":>8} {"p50 ms":>8} {"p99 ms":>8}')
+    for size in PAGE_SIZES:
+        response = page(size)
+        for name, render in (('stdlib', stdlib), ('orjson', orjson), ('direct', direct)):
+            samples = await measure(render, response)
+            print(f'{size:>6} {name:>8} {percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f}')
+
+
+if __name__ == '__main__':
+    argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter).parse_args()
+    asyncio.run(main())
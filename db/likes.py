@@ -0,0 +1,68 @@
+from datetime import datetime
+from typing import List, Tuple
+
+import asyncpg
+
+from misc import db
+
+TABLE = 'post_likes'
+
+
+async def get_likes(
+        conn: db.Connection,
+        post_ids: List[int]
+) -> List[asyncpg.Record]:
+    return await db.get_list(
+        conn=conn,
+        table=TABLE,
+        where='post_id = ANY($1::bigint[])',
+        values=[post_ids],
+        fields=['post_id', 'user_id', 'created_at']
+    )
+
+
+async def add_likes(
+        conn: db.Connection,
+        likes: List[Tuple[int, int, datetime]]
+):
+    """
+    Inserts (post_id, user_id, created_at) rows in one statement, rows that
+    already exist or point to deleted posts and users are skipped.
+    """
+    if not likes:
+        return
+    post_ids, user_ids, created = zip(*likes)
+    await db.execute(
+        conn,
+        f'''
+        INSERT INTO {TABLE} (post_id, user_id, created_at)
+        SELECT v.post_id, v.user_id, v.created_at
+        FROM unnest($1::bigint[], $2::bigint[], $3::timestamp[]) AS v(post_id, user_id, created_at)
+        JOIN posts ON posts.id = v.post_id
+        JOIN users ON users.id = v.user_id
+        ON CONFLICT DO NOTHING
+        ''',
+        list(post_ids),
+        list(user_ids),
+        list(created)
+    )
+
+
+async def remove_likes(
+        conn: db.Connection,
+        likes: List[Tuple[int, int]]
+):
+    if not likes:
+        return
+    post_ids, user_ids = zip(*likes)
+    await db.execute(
+        conn,
+        f'''
+        DELETE FROM {TABLE}
+        WHERE (post_id, user_id) IN (
+            SELECT * FROM unnest($1::bigint[], $2::bigint[])
+        )
+        ''',
+        list(post_ids),
+        list(user_ids)
+    )
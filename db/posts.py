@@ -1,12 +1,31 @@
 import logging
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Optional, List, Any, AsyncGenerator
 
-from misc import db
+import asyncpg
+
+from misc import db, cursor, lookups
 from models import posts
+from models.base import Lookup
 
 logger = logging.getLogger(__name__)
 
 TABLE = "posts"
+ORDER = ['-created_at', '-id']
+EXPORT_ORDER = ['created_at', 'id']
+# explicit, `SELECT *` would also read the search tsvector
+FIELDS = ['id', 'title', 'body', 'created_at', 'author_id']
+# filters and orders GET /posts/ accepts, keep them to what the indexes serve
+LOOKUP_COLUMNS = {
+    'id': lookups.Column(lookups.int8, lookups.RANGE + (lookups.OperatorType.IN,)),
+    'author_id': lookups.Column(lookups.int8, (lookups.OperatorType.EQ, lookups.OperatorType.IN)),
+    'created_at': lookups.Column(lambda value: utc_naive(datetime.fromisoformat(value)), lookups.RANGE),
+}
+LOOKUP_ORDERS = [ORDER, ['created_at', 'id']]
+SEARCH_CONFIG = 'english'
+SEARCH_CANDIDATES = 10000
+SNIPPET_OPTIONS = 'StartSel=<b>, StopSel=</b>, MaxWords=30, MinWords=10, MaxFragments=1'
+BULK_COLUMNS = ['id', 'title', 'body', 'created_at', 'author_id']
 
 
 async def create_post(
@@ -23,24 +42,60 @@ async def create_post(
                 "author_id": user_id,
                 "title": new_post.title,
                 "body": new_post.body
-            }
-        )
+            },
+            fields=FIELDS
+        ),
+        trusted=True
+    )
+
+
+async def create_posts_bulk(
+        conn: db.LazyConnection,
+        user_id: int,
+        new_posts: List[posts.NewPost]
+) -> List[posts.Post]:
+    """
+    Inserts all posts with one COPY, ids are reserved from the sequence first
+    so the created posts can be returned. All or nothing.
+    """
+    if not new_posts:
+        return []
+    async with conn.acquire():
+        async with conn.transaction():
+            reserved = await db.reserve_ids(conn, TABLE, len(new_posts))
+            records = [
+                (i['id'], new_post.title, new_post.body, i['created_at'], user_id)
+                for i, new_post in zip(reserved, new_posts)
+            ]
+            await db.copy_records(conn, TABLE, BULK_COLUMNS, records)
+    return db.record_to_model_list(
+        posts.Post,
+        [dict(zip(BULK_COLUMNS, i)) for i in records],
+        trusted=True
     )
 
 
 async def update_post(
         conn: db.Connection,
         post_id: int,
+        user_id: int,
         update_model: posts.UpdatePost
 ) -> Optional[posts.Post]:
+    """
+    None if the post does not exist, db.NotOwnerError if `user_id` is not its author
+    """
     return db.record_to_model(
         posts.Post,
-        await db.update(
+        await db.update_owned(
             conn=conn,
             table=TABLE,
             pk=post_id,
-            data=update_model.dict(exclude_none=True)
-        )
+            owner_field='author_id',
+            owner_id=user_id,
+            data=update_model.dict(exclude_none=True),
+            fields=FIELDS
+        ),
+        trusted=True
     )
 
 
@@ -53,43 +108,208 @@ async def get_post(
         await db.get(
             conn=conn,
             table=TABLE,
-            pk=post_id
-        )
+            pk=post_id,
+            fields=FIELDS
+        ),
+        trusted=True
     )
 
 
 async def get_posts_list(
         conn: db.Connection,
         page: int,
-        limit: int
+        limit: int,
+        after: Optional[str] = None,
+        lookup: Optional[Lookup] = None
 ) -> list[posts.Post]:
+    """
+    lookups.InvalidLookup if `lookup` uses a column, operator or order
+    outside LOOKUP_COLUMNS and LOOKUP_ORDERS
+    """
+    keyset = decode_cursor(after) if after else None
+    where, values, order = lookups.compile_lookup(lookup or Lookup(), LOOKUP_COLUMNS, LOOKUP_ORDERS)
     return db.record_to_model_list(
         posts.Post,
         await db.get_list(
             conn=conn,
             table=TABLE,
             limit=limit,
-            offset=limit * (page - 1),
-            where=""
-        )
+            offset=None if keyset else limit * (page - 1),
+            order=order or ORDER,
+            after=keyset,
+            where=where,
+            values=values,
+            fields=FIELDS
+        ),
+        trusted=True
     )
 
 
-async def get_total(
+async def get_author_posts(
         conn: db.Connection,
-) -> int:
-    return (await db.get_total(conn, TABLE)).get('count', 0)
+        author_id: int,
+        limit: int,
+        after: Optional[str] = None
+) -> list[posts.Post]:
+    """
+    newest posts of the author, keyset paginated over the
+    (author_id, created_at DESC, id DESC) index
+    """
+    return db.record_to_model_list(
+        posts.Post,
+        await db.get_list(
+            conn=conn,
+            table=TABLE,
+            limit=limit,
+            order=ORDER,
+            after=decode_cursor(after) if after else None,
+            where="author_id = $1",
+            values=[author_id],
+            fields=FIELDS
+        ),
+        trusted=True
+    )
+
+
+async def export_posts(
+        conn: db.LazyConnection,
+        author_id: Optional[int] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None
+) -> AsyncGenerator[asyncpg.Record, None]:
+    """
+    Every post matching the filters, oldest first, read through a server side
+    cursor. `created_from` is inclusive, `created_to` exclusive.
+    """
+    wheres = []
+    values = []
+    for condition, value in (
+            ('author_id = ${}', author_id),
+            ('created_at >= ${}', utc_naive(created_from)),
+            ('created_at < ${}', utc_naive(created_to))
+    ):
+        if value is not None:
+            values.append(value)
+            wheres.append(condition.format(len(values)))
+    async for record in db.iterate(
+            conn=conn,
+            table=TABLE,
+            where=' AND '.join(wheres),
+            values=values,
+            order=EXPORT_ORDER,
+            fields=FIELDS
+    ):
+        yield record
+
+
+def utc_naive(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    created_at is stored as utc without time zone
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+async def search_posts(
+        conn: db.Connection,
+        query: str,
+        limit: int,
+        after: Optional[str] = None,
+        candidates: int = SEARCH_CANDIDATES
+) -> List[posts.SearchPost]:
+    """
+    Posts matching the web search style `query`, best ranked first, with a
+    highlighted snippet of the body. Relevance is approximate: only the
+    `candidates` newest matches are ranked, older matches can be missed. This
+    does not bound the cost of a common term, every match is still read to
+    pick the newest. The candidate set is the same on every page, so cursors
+    stay consistent.
+    The snippet is HTML: the body is escaped, only the <b></b> marks are markup.
+    """
+    keyset = decode_search_cursor(after) if after else None
+    return db.record_to_model_list(
+        posts.SearchPost,
+        await db.fetch(
+            conn,
+            db.QUERIES.get(('search_posts', bool(keyset)), lambda: search_query(bool(keyset))),
+            query,
+            candidates,
+            limit,
+            *(keyset or ())
+        ),
+        trusted=True
+    )
+
+
+def search_query(with_keyset: bool) -> str:
+    # the tsquery is repeated instead of joined from a CTE so that the
+    # planner sees a constant and uses the GIN index
+    tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', $1)"
+    # bodies are user text, escaped so the snippet only carries our markup
+    escaped_body = "replace(replace(replace(page.body, '&', '&amp;'), '<', '&lt;'), '>', '&gt;')"
+    return f"""
+        WITH candidates AS (
+            SELECT {', '.join(FIELDS)}, ts_rank(search, {tsquery}) AS rank
+            FROM {TABLE}
+            WHERE search @@ {tsquery}
+            ORDER BY id DESC
+            LIMIT $2
+        ),
+        page AS (
+            SELECT * FROM candidates
+            {'WHERE (rank, id) < ($4, $5)' if with_keyset else ''}
+            ORDER BY rank DESC, id DESC
+            LIMIT $3
+        )
+        SELECT page.*, ts_headline('{SEARCH_CONFIG}', {escaped_body}, {tsquery}, '{SNIPPET_OPTIONS}') AS snippet
+        FROM page
+        ORDER BY rank DESC, id DESC
+        """
+
+
+def encode_search_cursor(post: posts.SearchPost) -> str:
+    return cursor.encode([post.rank, post.id])
+
+
+def decode_search_cursor(token: str) -> List[Any]:
+    values = cursor.decode(token)
+    try:
+        rank, post_id = values
+        return [float(rank), lookups.int8(post_id)]
+    except (TypeError, ValueError):
+        raise cursor.InvalidCursor(token)
+
+
+def encode_cursor(post: posts.Post) -> str:
+    return cursor.encode([post.created_at.isoformat(), post.id])
+
+
+def decode_cursor(token: str) -> List[Any]:
+    values = cursor.decode(token)
+    try:
+        created_at, post_id = values
+        return [datetime.fromisoformat(created_at), lookups.int8(post_id)]
+    except (TypeError, ValueError):
+        raise cursor.InvalidCursor(token)
 
 
 async def delete_post(
         conn: db.Connection,
-        post_id: int
+        post_id: int,
+        user_id: int
 ) -> Optional[posts.Post]:
+    """
+    None if the post does not exist, db.NotOwnerError if `user_id` is not its author
+    """
     return db.record_to_model(
         posts.Post,
-        await db.delete_by_where(
+        await db.delete_owned(
             conn=conn,
+            table=TABLE,
             pk=post_id,
-            table=TABLE
-        )
+            owner_field='author_id',
+            owner_id=user_id
+        ),
+        trusted=True
     )
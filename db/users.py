@@ -1,9 +1,10 @@
-from typing import Optional
+from typing import Optional, Tuple
 
 from misc import db
 from models import users
 
 TABLE = 'users'
+UPDATE_FIELDS = ['en', 'name']
 
 
 async def create_user(
@@ -11,6 +12,9 @@ async def create_user(
         name: str,
         password: str
 ) -> Optional[users.User]:
+    """
+    None if the name is taken
+    """
     return db.record_to_model(
         users.User,
         await db.create(
@@ -19,24 +23,73 @@ async def create_user(
             data={
                 'name': name,
                 "pass_hash": password
-            }
-        )
+            },
+            on_conflict_do_nothing=True
+        ),
+        trusted=True
     )
 
 
-async def get_user_by_creds(
+async def get_user_with_hash(
         conn: db.Connection,
-        name: str,
-        password: str
+        name: str
+) -> Optional[Tuple[users.User, str]]:
+    """
+    enabled user by name with the stored password hash, looked up through
+    the unique (en, name) index
+    """
+    record = await db.get_by_where(
+        conn=conn,
+        table=TABLE,
+        where=" en = true and name = $1 ",
+        values=[name]
+    )
+    if record is None:
+        return None
+    return db.record_to_model(users.User, record, trusted=True), record['pass_hash']
+
+
+async def update_password_hash(
+        conn: db.Connection,
+        pk: int,
+        old_hash: str,
+        new_hash: str
 ) -> Optional[users.User]:
+    """
+    replaces the hash only if it was not changed since `old_hash` was read
+    """
     return db.record_to_model(
         users.User,
-        await db.get_by_where(
+        await db.update_by_where(
+            conn=conn,
+            table=TABLE,
+            data={'pass_hash': new_hash},
+            where=" id = $1 and pass_hash = $2 ",
+            values=[pk, old_hash]
+        ),
+        trusted=True
+    )
+
+
+async def update_user(
+        conn: db.Connection,
+        pk: int,
+        data: dict
+) -> Optional[users.User]:
+    """
+    changes `en` and `name`, keys outside UPDATE_FIELDS are ignored.
+    Use misc.users.update, it also drops the cached snapshots
+    """
+    return db.record_to_model(
+        users.User,
+        await db.update(
             conn=conn,
             table=TABLE,
-            where=" name = $1 and pass_hash = $2",
-            values=[name, password]
-        )
+            pk=pk,
+            data=data,
+            update_fields=UPDATE_FIELDS
+        ),
+        trusted=True
     )
 
 
@@ -51,7 +104,8 @@ async def get_user_by_name(
             table=TABLE,
             where=" name = $1 ",
             values=[name]
-        )
+        ),
+        trusted=True
     )
 
 async def get_user(
@@ -64,5 +118,6 @@ async def get_user(
             conn=conn,
             table=TABLE,
             pk=pk
-        )
+        ),
+        trusted=True
     )
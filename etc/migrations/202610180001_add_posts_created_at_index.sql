@@ -0,0 +1,9 @@
+-- migrate:up transaction:false
+
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_created_at_id_index ON posts(created_at DESC, id DESC);
+
+
+-- migrate:down transaction:false
+
+DROP INDEX CONCURRENTLY IF EXISTS posts_created_at_id_index;
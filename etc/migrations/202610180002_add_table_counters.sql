@@ -0,0 +1,62 @@
+-- migrate:up
+
+
+CREATE TABLE table_counters (
+    table_name VARCHAR(63) PRIMARY KEY,
+    count BIGINT NOT NULL DEFAULT 0
+);
+
+
+CREATE FUNCTION table_counters_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE table_counters
+    SET count = count + (SELECT count(*) FROM new_rows)
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE FUNCTION table_counters_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE table_counters
+    SET count = count - (SELECT count(*) FROM old_rows)
+    WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$;
+
+
+CREATE FUNCTION table_counters_truncate() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    UPDATE table_counters SET count = 0 WHERE table_name = TG_TABLE_NAME;
+    RETURN NULL;
+END;
+$$;
+
+
+LOCK TABLE posts IN SHARE MODE;
+
+INSERT INTO table_counters (table_name, count) SELECT 'posts', count(*) FROM posts;
+
+CREATE TRIGGER posts_count_insert AFTER INSERT ON posts
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION table_counters_insert();
+
+CREATE TRIGGER posts_count_delete AFTER DELETE ON posts
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION table_counters_delete();
+
+CREATE TRIGGER posts_count_truncate AFTER TRUNCATE ON posts
+    FOR EACH STATEMENT EXECUTE FUNCTION table_counters_truncate();
+
+
+-- migrate:down
+
+DROP TRIGGER IF EXISTS posts_count_truncate ON posts;
+DROP TRIGGER IF EXISTS posts_count_delete ON posts;
+DROP TRIGGER IF EXISTS posts_count_insert ON posts;
+DROP FUNCTION IF EXISTS table_counters_truncate();
+DROP FUNCTION IF EXISTS table_counters_delete();
+DROP FUNCTION IF EXISTS table_counters_insert();
+DROP TABLE IF EXISTS table_counters;
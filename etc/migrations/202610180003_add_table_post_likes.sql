@@ -0,0 +1,17 @@
+-- migrate:up
+
+
+CREATE TABLE post_likes (
+    post_id BIGINT NOT NULL REFERENCES posts(id) ON DELETE CASCADE,
+    user_id BIGINT NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    created_at timestamp WITHOUT TIME ZONE NOT NULL DEFAULT (NOW() at time zone 'utc'),
+    PRIMARY KEY (post_id, user_id)
+);
+
+
+CREATE INDEX post_likes_user_id_index ON post_likes(user_id);
+
+
+-- migrate:down
+
+DROP TABLE IF EXISTS post_likes;
@@ -0,0 +1,12 @@
+-- migrate:up
+
+
+-- rewrites the table, run it in a maintenance window on large tables
+ALTER TABLE posts ADD COLUMN search tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('english', title), 'A') || setweight(to_tsvector('english', body), 'B')
+) STORED;
+
+
+-- migrate:down
+
+ALTER TABLE posts DROP COLUMN IF EXISTS search;
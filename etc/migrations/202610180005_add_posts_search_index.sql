@@ -0,0 +1,9 @@
+-- migrate:up transaction:false
+
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS posts_search_index ON posts USING GIN (search);
+
+
+-- migrate:down transaction:false
+
+DROP INDEX CONCURRENTLY IF EXISTS posts_search_index;
@@ -0,0 +1,145 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Optional,
+    Type,
+)
+
+from misc import redis, encoding
+from misc.db import ModelCls
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class LocalCache(object):
+    """
+    In-process LRU with a bounded size and a TTL per entry.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 5):
+        super().__init__()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any:
+        item = self._items.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return MISSING
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key: Hashable, value: Any):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class ModelCache(Generic[ModelCls]):
+    """
+    Read-through cache of pydantic models: in-process LRU (optional, keep
+    `local_ttl` short, other workers only see invalidations when it expires),
+    then redis, then `load`.
+    Models taken from the LRU are copies, callers may change them.
+    """
+
+    def __init__(
+            self,
+            prefix: str,
+            model_cls: Type[ModelCls],
+            ttl: int = 60,
+            local_size: int = 1024,
+            local_ttl: float = 5
+    ):
+        super().__init__()
+        self.prefix = prefix
+        self.model_cls = model_cls
+        self.ttl = ttl
+        self.local = LocalCache(local_size, local_ttl) if local_size > 0 else None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_config(cls, prefix: str, model_cls: Type[ModelCls], config: dict) -> 'ModelCache[ModelCls]':
+        return cls(prefix, model_cls, **config)
+
+    async def get(
+            self,
+            key: Hashable,
+            conn: redis.Connection,
+            load: Callable[[], Awaitable[Optional[ModelCls]]]
+    ) -> Optional[ModelCls]:
+        """
+        Models are stored in redis with the key's version read before `load`:
+        a model loaded before a concurrent `invalidate` is written with the
+        old version and read as a miss, instead of pinning the old row.
+        """
+        if self.local is not None and (model := self.local.get(key)) is not MISSING:
+            return model.copy()
+        invalidations = self.invalidations
+        version, data = await conn.mget(self.version_key(key), self.cache_key(key))
+        version = int(version or 0)
+        if data is not None and (cached := encoding.loads(data)).get('version') == version:
+            self.hits += 1
+            model = self.model_cls.parse_obj(cached['model'])
+        else:
+            self.misses += 1
+            if (model := await load()) is None:
+                return None
+            await conn.setex(
+                self.cache_key(key),
+                self.ttl,
+                encoding.dumps({'version': version, 'model': model.dict()})
+            )
+        # an invalidation in this worker meanwhile may be for this key
+        if self.local is not None and invalidations == self.invalidations:
+            self.local.set(key, model.copy())
+        return model
+
+    async def invalidate(self, key: Hashable, conn: redis.Connection):
+        self.invalidations += 1
+        if self.local is not None:
+            self.local.delete(key)
+        await conn.incr(self.version_key(key))
+
+    def cache_key(self, key: Hashable) -> str:
+        return f'{self.prefix}_{key}'
+
+    def version_key(self, key: Hashable) -> str:
+        return f'{self.prefix}_version_{key}'
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'local_hits': self.local.hits if self.local is not None else 0,
+            'local_misses': self.local.misses if self.local is not None else 0,
+            'local_size': len(self.local) if self.local is not None else 0,
+            'redis_hits': self.hits,
+            'redis_misses': self.misses,
+            'invalidations': self.invalidations
+        }
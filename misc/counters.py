@@ -0,0 +1,73 @@
+import asyncio
+import logging
+from typing import Tuple, Dict
+
+from misc import db, redis
+
+logger = logging.getLogger(__name__)
+
+COUNT = 'count'
+EXACT = 'exact'
+ESTIMATE = 'estimate'
+CACHED = 'cached'
+# filtered lists, the total of the table does not apply and is reported as -1
+NONE = 'none'
+
+DEFAULT_TTL = 60
+
+_refresh_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def get_total(
+        table: str,
+        conn: db.Connection,
+        cache: redis.Connection,
+        config: dict
+) -> Tuple[int, str]:
+    """
+    Total rows of `table` using the mode configured in `config[table]['mode']`:
+     - exact: trigger-maintained row in table_counters
+     - estimate: planner statistics from pg_class.reltuples
+     - cached: count(*) cached in redis for `ttl` seconds
+     - count: plain count(*) (default)
+    Returns the total and the mode that actually produced it, falls back to
+    count(*) when the configured source has no value.
+    """
+    settings = config.get(table, {})
+    mode = settings.get('mode', COUNT)
+    if mode == EXACT:
+        if (record := await db.get_counter(conn, table)) is not None:
+            return record['count'], EXACT
+    elif mode == ESTIMATE:
+        record = await db.get_estimated_total(conn, table)
+        # reltuples is -1 until the table was vacuumed or analyzed
+        if record is not None and record['count'] >= 0:
+            return record['count'], ESTIMATE
+    elif mode == CACHED:
+        return await get_cached_total(table, conn, cache, settings.get('ttl', DEFAULT_TTL)), CACHED
+    return await count(table, conn), COUNT
+
+
+async def get_cached_total(
+        table: str,
+        conn: db.Connection,
+        cache: redis.Connection,
+        ttl: int
+) -> int:
+    if (total := await redis.get(cache_key(table), cache)) is not None:
+        return total
+    lock = _refresh_locks.setdefault(table, asyncio.Lock())
+    async with lock:
+        if (total := await redis.get(cache_key(table), cache)) is not None:
+            return total
+        total = await count(table, conn)
+        await redis.setex(cache_key(table), ttl, total, cache)
+        return total
+
+
+async def count(table: str, conn: db.Connection) -> int:
+    return (await db.get_total(conn, table)).get('count', 0)
+
+
+def cache_key(table: str) -> str:
+    return f'count_{table}'
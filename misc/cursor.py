@@ -0,0 +1,24 @@
+import base64
+import binascii
+import json
+from typing import Any, List
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode(values: List[Any]) -> str:
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode(token: str) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (binascii.Error, ValueError):
+        raise InvalidCursor(token)
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
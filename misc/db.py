@@ -1,11 +1,18 @@
-import json
+import contextlib
 import logging
+import re
+import time
 from typing import (
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
     Optional,
     Any,
     List,
     Dict,
     Union,
+    Tuple,
     Type,
     TypeVar
 )
@@ -13,20 +20,301 @@ from typing import (
 import asyncpg
 from pydantic import BaseModel
 
+from misc import encoding, metrics
+
 logger = logging.getLogger(__name__)
 
 Connection = asyncpg.Connection
+Pool = asyncpg.Pool
 ModelCls = TypeVar('ModelCls', bound=BaseModel)
 
 
+SLOW_QUERY_THRESHOLD = 0.5
+CURSOR_PREFETCH = 1000
+STATEMENT_LENGTH = 200
+MAX_STATEMENTS = 1024
+# label of statements beyond MAX_STATEMENTS, keeps the label set bounded
+OTHER_STATEMENT = 'other'
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'VALUES')
+EXPLAINABLE_METHODS = ('execute', 'fetch', 'fetchrow', 'fetchval')
+# run through prepared statements, `execute` only with arguments
+PREPARED_METHODS = ('execute', 'executemany', 'fetch', 'fetchrow', 'fetchval')
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'(?<![\w$])\d+(?:\.\d+)?')
+
+QUERY_SECONDS = metrics.Histogram(
+    'db_query_seconds',
+    'Statement execution time without the wait for a pool connection',
+    ['statement']
+)
+QUERY_ROWS = metrics.Histogram(
+    'db_query_rows',
+    'Rows returned or affected by a statement',
+    ['statement'],
+    buckets=(0, 1, 10, 100, 1000, 10000)
+)
+QUERY_ERRORS = metrics.Counter(
+    'db_query_errors_total',
+    'Statements that raised',
+    ['statement']
+)
+STATEMENT_CACHE = metrics.Counter(
+    'db_statement_cache_total',
+    'Statements whose prepared statement asyncpg had cached on the connection (hit) or had to prepare (miss)',
+    ['result']
+)
+POOL_WAIT_SECONDS = metrics.Histogram(
+    'db_pool_wait_seconds',
+    'Time waiting for a connection of the pool'
+)
+
+
+class NotOwnerError(Exception):
+    pass
+
+
+class LazyConnection(object):
+    """
+    Connection handle that takes a pool connection for each statement and
+    gives it back right after, so nothing is held between statements or when
+    no query runs at all. Statements inside `acquire()` share one connection,
+    use it for units of work such as transactions.
+    `pool` may be a callable picking the pool at each checkout, for choices
+    that depend on request state set after the handle was made.
+    `on_use` is awaited once, before the first connection is taken.
+    Every statement and pool wait is recorded by INSTRUMENTATION.
+    """
+
+    def __init__(self, pool: Union[asyncpg.Pool, Callable[[], asyncpg.Pool]]):
+        super().__init__()
+        self._pool = pool
+        self._conn: Optional[asyncpg.Connection] = None
+        self.on_use: Optional[Callable[[], Awaitable[None]]] = None
+
+    @property
+    def pool(self) -> asyncpg.Pool:
+        return self._pool() if callable(self._pool) else self._pool
+
+    @contextlib.asynccontextmanager
+    async def acquire(self) -> AsyncIterator['LazyConnection']:
+        if self._conn is not None:
+            yield self
+            return
+        async with self._checkout() as conn:
+            self._conn = conn
+            try:
+                yield self
+            finally:
+                self._conn = None
+
+    def transaction(self, **kwargs) -> asyncpg.transaction.Transaction:
+        if self._conn is None:
+            raise RuntimeError('Transactions need a connection taken with acquire()')
+        return self._conn.transaction(**kwargs)
+
+    def cursor(self, query: str, *args, **kwargs) -> asyncpg.cursor.CursorFactory:
+        if self._conn is None:
+            raise RuntimeError('Cursors need a connection taken with acquire()')
+        return self._conn.cursor(query, *args, **kwargs)
+
+    async def execute(self, query: str, *args, **kwargs) -> str:
+        return await self._run('execute', query, args, kwargs)
+
+    async def executemany(self, query: str, args, **kwargs):
+        return await self._run('executemany', query, (args,), kwargs)
+
+    async def fetch(self, query: str, *args, **kwargs) -> List[asyncpg.Record]:
+        return await self._run('fetch', query, args, kwargs)
+
+    async def fetchrow(self, query: str, *args, **kwargs) -> Optional[asyncpg.Record]:
+        return await self._run('fetchrow', query, args, kwargs)
+
+    async def fetchval(self, query: str, *args, **kwargs) -> Any:
+        return await self._run('fetchval', query, args, kwargs)
+
+    async def copy_records_to_table(self, table_name: str, **kwargs) -> str:
+        async with self.acquire():
+            return await INSTRUMENTATION.run(
+                self._conn, 'copy_records_to_table', f'COPY {table_name}', (), kwargs, table_name
+            )
+
+    async def _run(self, method: str, query: str, args: tuple, kwargs: dict) -> Any:
+        if self._conn is not None:
+            return await INSTRUMENTATION.run(self._conn, method, query, args, kwargs)
+        async with self._checkout() as conn:
+            return await INSTRUMENTATION.run(conn, method, query, args, kwargs)
+
+    @contextlib.asynccontextmanager
+    async def _checkout(self) -> AsyncIterator[asyncpg.Connection]:
+        if (on_use := self.on_use) is not None:
+            self.on_use = None
+            await on_use()
+        start = time.perf_counter()
+        async with self.pool.acquire() as conn:
+            POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+            yield conn
+
+
+class Instrumentation(object):
+    """
+    Latency and row count histograms per normalized statement, and a log of
+    statements slower than `slow_threshold` seconds, with their plan when
+    `explain` is set (plain EXPLAIN, the statement is not run again).
+    """
+
+    def __init__(self, slow_threshold: Optional[float] = SLOW_QUERY_THRESHOLD, explain: bool = False):
+        super().__init__()
+        self.slow_threshold = slow_threshold
+        self.explain = explain
+        self.slow_queries = 0
+        self._statements: Dict[str, str] = {}
+
+    def configure(self, config: dict):
+        self.slow_threshold = config.get('threshold', SLOW_QUERY_THRESHOLD)
+        self.explain = config.get('explain', False)
+
+    async def run(
+            self,
+            conn: asyncpg.Connection,
+            method: str,
+            query: str,
+            args: tuple,
+            kwargs: dict,
+            *call_args
+    ) -> Any:
+        statement = self.normalize(query)
+        if method in PREPARED_METHODS and (args or method != 'execute'):
+            if (cached := statement_cached(conn, query)) is not None:
+                STATEMENT_CACHE.inc('hit' if cached else 'miss')
+        start = time.perf_counter()
+        try:
+            result = await getattr(conn, method)(*(call_args or (query,)), *args, **kwargs)
+        except:
+            QUERY_ERRORS.inc(statement)
+            raise
+        elapsed = time.perf_counter() - start
+        rows = row_count(result)
+        QUERY_SECONDS.observe(elapsed, statement)
+        QUERY_ROWS.observe(rows, statement)
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            self.slow_queries += 1
+            await self.log_slow(conn, query, args if method in EXPLAINABLE_METHODS else None, elapsed, rows)
+        return result
+
+    async def log_slow(
+            self,
+            conn: asyncpg.Connection,
+            query: str,
+            args: Optional[tuple],
+            elapsed: float,
+            rows: int
+    ):
+        plan = ''
+        if self.explain and args is not None and query.split(None, 1)[0].upper() in EXPLAINABLE:
+            try:
+                plan = '\n' + '\n'.join(i[0] for i in await conn.fetch(f'EXPLAIN {query}', *args))
+            except:
+                logger.exception(f'Explain of {query} failed')
+        logger.warning(f'Slow query {elapsed:.3f}s, {rows} rows: {" ".join(query.split())}{plan}')
+
+    def normalize(self, query: str) -> str:
+        if (statement := self._statements.get(query)) is None:
+            if len(self._statements) >= MAX_STATEMENTS:
+                return OTHER_STATEMENT
+            statement = NUMBER_LITERAL.sub('?', STRING_LITERAL.sub('?', ' '.join(query.split())))[:STATEMENT_LENGTH]
+            self._statements[query] = statement
+        return statement
+
+
+def row_count(result: Any) -> int:
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, str):
+        # command status: INSERT 0 5, UPDATE 3, COPY 10
+        tail = result.rpartition(' ')[2]
+        return int(tail) if tail.isdigit() else 0
+    return int(result is not None)
+
+
+def statement_cached(conn: asyncpg.Connection, query: str) -> Optional[bool]:
+    """
+    Whether asyncpg has `query` prepared on `conn`, read from its private
+    statement cache (keyed as in asyncpg 0.27), None when that is not there.
+    """
+    try:
+        return conn._stmt_cache.has((query, conn._protocol.get_record_class(), False))
+    except AttributeError:
+        return None
+
+
+def statement_cache_stats() -> Dict[str, Union[int, float]]:
+    counts = {labels[0]: value for labels, value in STATEMENT_CACHE.snapshot()}
+    hits, misses = counts.get('hit', 0), counts.get('miss', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0
+    }
+
+
+INSTRUMENTATION = Instrumentation()
+
+
+class QueryRegistry(object):
+    """
+    SQL text of the generic query builders, built once per statement shape
+    (table, fields, where, ...). Every variable value is a bind parameter, so
+    the text of a shape does not change between calls, which is what lets
+    asyncpg reuse its prepared statements. Its hits only count skipped string
+    building; prepared statement reuse is STATEMENT_CACHE.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        super().__init__()
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._queries: Dict[Tuple, str] = {}
+
+    def get(self, shape: Tuple, build: Callable[[], str]) -> str:
+        if (query := self._queries.get(shape)) is not None:
+            self.hits += 1
+            return query
+        self.misses += 1
+        query = build()
+        if len(self._queries) < self.maxsize:
+            self._queries[shape] = query
+        else:
+            logger.warning(f'Query registry is full, {shape} is built on every call')
+        return query
+
+    def clear(self):
+        self._queries.clear()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        total = self.hits + self.misses
+        return {
+            'statements': len(self._queries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0
+        }
+
+
+QUERIES = QueryRegistry()
+
+
 async def init(config: dict) -> asyncpg.Pool:
     dsn = config.get('dsn')
     if not dsn:
         raise RuntimeError('DB connection parameters not defined')
+    INSTRUMENTATION.configure(config.get('slow_query', {}))
     return await asyncpg.create_pool(
         dsn,
         init=init_connection,
-        **{k: v for k, v in config.items() if k != 'dsn'}
+        **{k: v for k, v in config.items() if k not in ('dsn', 'replicas', 'slow_query')}
     )
 
 
@@ -44,8 +332,8 @@ async def close(db: Union[asyncpg.Pool, asyncpg.Connection]):
 async def init_connection(conn):
     await conn.set_type_codec(
         'jsonb',
-        encoder=json.dumps,
-        decoder=json.loads,
+        encoder=encoding.dumps_str,
+        decoder=encoding.loads,
         schema='pg_catalog'
     )
     return conn
@@ -58,8 +346,10 @@ async def get_by_where(
         values: Optional[List] = [],
         fields: Optional[List[str]] = None
 ) -> Optional[asyncpg.Record]:
-    select_fields = ', '.join(fields) if fields else '*'
-    query = f'SELECT {select_fields} FROM {table} WHERE {where}'
+    query = QUERIES.get(
+        ('get_by_where', table, where, tuple(fields or ())),
+        lambda: f'SELECT {", ".join(fields) if fields else "*"} FROM {table} WHERE {where}'
+    )
     try:
         return await conn.fetchrow(query, *values)
     except:
@@ -67,8 +357,14 @@ async def get_by_where(
         raise
 
 
-def record_to_model_list(model_cls: Type[ModelCls], records: List[asyncpg.Record]) -> List[ModelCls]:
+def record_to_model_list(
+        model_cls: Type[ModelCls],
+        records: List[asyncpg.Record],
+        trusted: bool = False
+) -> List[ModelCls]:
     if records:
+        if trusted:
+            return list(map(trusted_converter(model_cls, tuple(records[0].keys())), records))
         models = []
         for i in records:
             record_model = record_to_model(model_cls, i)
@@ -78,20 +374,81 @@ def record_to_model_list(model_cls: Type[ModelCls], records: List[asyncpg.Record
     return []
 
 
-def record_to_model(model_cls: Type[ModelCls], record: Optional[asyncpg.Record]) -> Optional[ModelCls]:
+def record_to_model(
+        model_cls: Type[ModelCls],
+        record: Optional[asyncpg.Record],
+        trusted: bool = False
+) -> Optional[ModelCls]:
+    """
+    `trusted` skips validation, use it only for rows of our own queries whose
+    column types already match the model.
+    """
     if record:
+        if trusted:
+            return trusted_converter(model_cls, tuple(record.keys()))(record)
         return model_cls.parse_obj(record)
     return None
 
 
+_converters: Dict[Tuple[Type[BaseModel], Tuple[str, ...]], Callable[[Any], BaseModel]] = {}
+
+
+def trusted_converter(model_cls: Type[ModelCls], columns: Tuple[str, ...]) -> Callable[[Any], ModelCls]:
+    """
+    Converter building `model_cls` without validation from rows with the
+    given columns, compiled on first use. Unknown columns are dropped.
+    """
+    if (converter := _converters.get((model_cls, columns))) is None:
+        converter = _converters[(model_cls, columns)] = compile_converter(model_cls, columns)
+    return converter
+
+
+def compile_converter(model_cls: Type[ModelCls], columns: Tuple[str, ...]) -> Callable[[Any], ModelCls]:
+    present = [(name, field.alias) for name, field in model_cls.__fields__.items() if field.alias in columns]
+    defaults = [(name, field) for name, field in model_cls.__fields__.items() if field.alias not in columns]
+    if required := [name for name, field in defaults if field.required]:
+        raise ValueError(f'{model_cls.__name__} requires columns missing from the query: {", ".join(required)}')
+    # defaults of immutable values are shared, the rest are made per row
+    template = {
+        name: None if field.alias in columns or field.default_factory else field.get_default()
+        for name, field in model_cls.__fields__.items()
+    }
+    factories = [(name, field) for name, field in defaults if field.default_factory or not is_immutable(field.default)]
+    fields_set = {name for name, _ in present}
+    has_private = bool(model_cls.__private_attributes__)
+    new = object.__new__
+    setattr_ = object.__setattr__
+
+    def convert(record) -> ModelCls:
+        values = template.copy()
+        for name, alias in present:
+            values[name] = record[alias]
+        for name, field in factories:
+            values[name] = field.get_default()
+        model = new(model_cls)
+        setattr_(model, '__dict__', values)
+        setattr_(model, '__fields_set__', set(fields_set))
+        if has_private:
+            model._init_private_attributes()
+        return model
+
+    return convert
+
+
+def is_immutable(value: Any) -> bool:
+    return value is None or isinstance(value, (bool, int, float, str, bytes, tuple, frozenset))
+
+
 async def get(
         conn: Connection,
         table: str,
         pk: int,
         fields: Optional[List[str]] = None
 ) -> Optional[asyncpg.Record]:
-    select_fields = ', '.join(fields) if fields else '*'
-    query = f'SELECT {select_fields} FROM {table} WHERE id = $1'
+    query = QUERIES.get(
+        ('get', table, tuple(fields or ())),
+        lambda: f'SELECT {", ".join(fields) if fields else "*"} FROM {table} WHERE id = $1'
+    )
     try:
         return await conn.fetchrow(query, pk)
     except:
@@ -105,13 +462,15 @@ async def create(
         data: Dict[str, Any],
         insert_fields: Optional[List[str]] = None,
         ignore_fields: Optional[List[str]] = None,
-        fields: Optional[List[str]] = []
+        fields: Optional[List[str]] = [],
+        on_conflict_do_nothing: bool = False
 ) -> Optional[asyncpg.Record]:
-    return_fields = ', '.join(fields) if fields else '*'
+    """
+    With `on_conflict_do_nothing` a row violating a unique constraint is not
+    inserted and None is returned instead of raising.
+    """
     field_names = []
-    placeholders = []
     values = []
-    idx = 1
     for key in data.keys():
         if insert_fields and key not in insert_fields:
             continue
@@ -120,10 +479,15 @@ async def create(
             continue
 
         field_names.append(key)
-        placeholders.append(f"${idx}")
         values.append(data[key])
-        idx += 1
-    query = f'INSERT INTO {table} ({", ".join(field_names)}) VALUES ({", ".join(placeholders)}) RETURNING {return_fields}'
+
+    def build() -> str:
+        return_fields = ', '.join(fields) if fields else '*'
+        placeholders = ', '.join(f'${idx}' for idx in range(1, len(field_names) + 1))
+        conflict = 'ON CONFLICT DO NOTHING' if on_conflict_do_nothing else ''
+        return f'INSERT INTO {table} ({", ".join(field_names)}) VALUES ({placeholders}) {conflict} RETURNING {return_fields}'
+
+    query = QUERIES.get(('create', table, tuple(field_names), tuple(fields or ()), on_conflict_do_nothing), build)
     try:
         return await conn.fetchrow(query, *values)
     except:
@@ -141,10 +505,8 @@ async def update(
         fields: Optional[List[str]] = [],
         with_atime: bool = False
 ) -> Optional[asyncpg.Record]:
-    return_fields = ', '.join(fields) if fields else '*'
-    placeholders = []
+    field_names = []
     values = []
-    idx = 1
     for key in data.keys():
         if with_atime and key == 'atime':
             continue
@@ -155,13 +517,15 @@ async def update(
         if ignore_fields and key in ignore_fields:
             continue
 
-        placeholders.append(f"{key} = ${idx}")
+        field_names.append(key)
         values.append(data[key])
-        idx += 1
-    if with_atime:
-        placeholders.append(f"atime = (now() at time zone 'utc')")
-    update = ', '.join(placeholders)
-    query = f'UPDATE {table} SET {update} WHERE id = ${len(values) + 1} RETURNING {return_fields}'
+
+    def build() -> str:
+        return_fields = ', '.join(fields) if fields else '*'
+        update = ', '.join(set_clauses(field_names, 1, with_atime))
+        return f'UPDATE {table} SET {update} WHERE id = ${len(field_names) + 1} RETURNING {return_fields}'
+
+    query = QUERIES.get(('update', table, tuple(field_names), tuple(fields or ()), with_atime), build)
     values.append(pk)
     try:
         return await conn.fetchrow(query, *values)
@@ -170,6 +534,91 @@ async def update(
         raise
 
 
+async def update_owned(
+        conn: Connection,
+        table: str,
+        pk: int,
+        owner_field: str,
+        owner_id: int,
+        data: Dict[str, Any],
+        fields: Optional[List[str]] = []
+) -> Optional[asyncpg.Record]:
+    """
+    Updates row `pk` only when `owner_field` equals `owner_id`, in one round trip.
+    Returns None when the row does not exist, raises NotOwnerError when it
+    belongs to someone else.
+    """
+    field_names = list(data.keys())
+    values = [pk, owner_id, *data.values()]
+
+    def build() -> str:
+        return_fields = ', '.join(fields) if fields else '*'
+        return f"""
+            WITH target AS (SELECT id FROM {table} WHERE id = $1),
+            changed AS (
+                UPDATE {table} SET {', '.join(set_clauses(field_names, 3))}
+                WHERE id = $1 AND {owner_field} = $2
+                RETURNING {return_fields}
+            )
+            SELECT target.id AS target_id, changed.* FROM target LEFT JOIN changed ON true
+            """
+
+    query = QUERIES.get(('update_owned', table, owner_field, tuple(field_names), tuple(fields or ())), build)
+    try:
+        record = await conn.fetchrow(query, *values)
+    except:
+        logger.exception(f'Query {query} failed')
+        raise
+    return owned_record(record)
+
+
+async def delete_owned(
+        conn: Connection,
+        table: str,
+        pk: int,
+        owner_field: str,
+        owner_id: int
+) -> Optional[asyncpg.Record]:
+    """
+    Deletes row `pk` only when `owner_field` equals `owner_id`, in one round trip.
+    Returns None when the row does not exist, raises NotOwnerError when it
+    belongs to someone else.
+    """
+    query = QUERIES.get(
+        ('delete_owned', table, owner_field),
+        lambda: f"""
+            WITH target AS (SELECT id FROM {table} WHERE id = $1),
+            changed AS (
+                DELETE FROM {table}
+                WHERE id = $1 AND {owner_field} = $2
+                RETURNING *
+            )
+            SELECT target.id AS target_id, changed.* FROM target LEFT JOIN changed ON true
+            """
+    )
+    try:
+        record = await conn.fetchrow(query, pk, owner_id)
+    except:
+        logger.exception(f'Query {query} failed')
+        raise
+    return owned_record(record)
+
+
+def set_clauses(field_names: List[str], first_idx: int, with_atime: bool = False) -> List[str]:
+    clauses = [f'{key} = ${idx}' for idx, key in enumerate(field_names, first_idx)]
+    if with_atime:
+        clauses.append("atime = (now() at time zone 'utc')")
+    return clauses
+
+
+def owned_record(record: Optional[asyncpg.Record]) -> Optional[asyncpg.Record]:
+    if record is None:
+        return None
+    if record['id'] is None:
+        raise NotOwnerError(record['target_id'])
+    return record
+
+
 async def update_by_where(
         conn: Connection,
         table: str,
@@ -181,10 +630,8 @@ async def update_by_where(
         fields: Optional[List[str]] = [],
         with_atime: bool = False
 ) -> Optional[asyncpg.Record]:
-    return_fields = ', '.join(fields) if fields else '*'
-    placeholders = []
+    field_names = []
     update_values = []
-    idx = len(values) + 1
     for key in data.keys():
         if with_atime and key == 'atime':
             continue
@@ -195,14 +642,20 @@ async def update_by_where(
         if ignore_fields and key in ignore_fields:
             continue
 
-        placeholders.append(f"{key} = ${idx}")
+        field_names.append(key)
         update_values.append(data[key])
-        idx += 1
-    if with_atime:
-        placeholders.append(f"atime = (now() at time zone 'utc')")
-    update = ', '.join(placeholders)
-    values.extend(update_values)
-    query = f'UPDATE {table} SET {update} WHERE {where} RETURNING {return_fields}'
+    where_count = len(values)
+    values = [*values, *update_values]
+
+    def build() -> str:
+        return_fields = ', '.join(fields) if fields else '*'
+        update = ', '.join(set_clauses(field_names, where_count + 1, with_atime))
+        return f'UPDATE {table} SET {update} WHERE {where} RETURNING {return_fields}'
+
+    query = QUERIES.get(
+        ('update_by_where', table, where, where_count, tuple(field_names), tuple(fields or ()), with_atime),
+        build
+    )
     try:
         return await conn.fetchrow(query, *values)
     except:
@@ -281,19 +734,42 @@ async def get_list(
         offset: Optional[int] = None,
         order: Optional[List[str]] = None,
         fields: List[str] = [],
+        after: Optional[List[Any]] = None,
 ) -> List[asyncpg.Record]:
-    select_fields = ', '.join(fields) if fields else '*'
-    where_query, limit_query, offset_query, order_query = '', '', '', ''
-    if where:
-        where_query = f'WHERE {where}'
-    if limit:
-        limit_query = f'LIMIT {limit}'
-    if offset:
-        offset_query = f'OFFSET {offset}'
-    if order:
-        order_query = 'ORDER BY ' + ', '.join([f'{i[1:]} DESC' if i.startswith('-') else i for i in order])
-
-    query = f'SELECT {select_fields} FROM {table} {where_query} {order_query} {limit_query} {offset_query}'
+    """
+    `after` switches to keyset pagination: rows strictly past the given
+    values of the `order` columns are returned, so page cost does not depend
+    on depth. `order` must use a single direction and be unique (end with pk).
+    LIMIT and OFFSET are bound as parameters, pages share one statement.
+    """
+    where_count = len(values)
+    values = [*values, *(after or ()), *([limit] if limit else []), *([offset] if offset else [])]
+
+    def build() -> str:
+        select_fields = ', '.join(fields) if fields else '*'
+        where_query, limit_query, offset_query, order_query = where, '', '', ''
+        idx = where_count + 1
+        if after:
+            where_query = keyset_where(where, where_count, order, len(after))
+            idx += len(after)
+        if where_query:
+            where_query = f'WHERE {where_query}'
+        if limit:
+            limit_query = f'LIMIT ${idx}'
+            idx += 1
+        if offset:
+            offset_query = f'OFFSET ${idx}'
+        if order:
+            order_query = 'ORDER BY ' + ', '.join([f'{i[1:]} DESC' if i.startswith('-') else i for i in order])
+        return f'SELECT {select_fields} FROM {table} {where_query} {order_query} {limit_query} {offset_query}'
+
+    query = QUERIES.get(
+        (
+            'list', table, tuple(fields), where, where_count, tuple(order or ()),
+            len(after or ()), bool(limit), bool(offset)
+        ),
+        build
+    )
     try:
         return await conn.fetch(query, *values)
     except:
@@ -301,6 +777,58 @@ async def get_list(
         raise
 
 
+async def iterate(
+        conn: LazyConnection,
+        table: str,
+        where: str,
+        values: List = [],
+        order: Optional[List[str]] = None,
+        fields: List[str] = [],
+        prefetch: int = CURSOR_PREFETCH
+) -> AsyncGenerator[asyncpg.Record, None]:
+    """
+    Rows of a server side cursor in a read only repeatable read transaction,
+    `prefetch` rows are held in memory at a time. The connection is held
+    until the generator is exhausted or closed.
+    """
+
+    def build() -> str:
+        select_fields = ', '.join(fields) if fields else '*'
+        where_query = f'WHERE {where}' if where else ''
+        order_query = ''
+        if order:
+            order_query = 'ORDER BY ' + ', '.join([f'{i[1:]} DESC' if i.startswith('-') else i for i in order])
+        return f'SELECT {select_fields} FROM {table} {where_query} {order_query}'
+
+    query = QUERIES.get(('iterate', table, tuple(fields), where, len(values), tuple(order or ())), build)
+    try:
+        async with conn.acquire():
+            async with conn.transaction(isolation='repeatable_read', readonly=True):
+                async for record in conn.cursor(query, *values, prefetch=prefetch):
+                    yield record
+    except Exception:
+        # not a bare except: closing the generator early is not a failure
+        logger.exception(f'Query {query} failed')
+        raise
+
+
+def keyset_where(
+        where: str,
+        values_count: int,
+        order: Optional[List[str]],
+        after_count: int
+) -> str:
+    if not order or len(order) != after_count:
+        raise ValueError('Keyset pagination requires one cursor value per order field')
+    directions = {i.startswith('-') for i in order}
+    if len(directions) != 1:
+        raise ValueError('Keyset pagination requires a single order direction')
+    columns = ', '.join(i.lstrip('-') for i in order)
+    placeholders = ', '.join(f'${values_count + idx}' for idx in range(1, after_count + 1))
+    keyset = f'({columns}) {"<" if directions.pop() else ">"} ({placeholders})'
+    return f'({where}) AND {keyset}' if where else keyset
+
+
 async def get_total(
         conn: Connection,
         table: str,
@@ -311,3 +839,87 @@ async def get_total(
     except:
         logger.exception(f'Query {query} failed')
         raise
+
+
+async def get_counter(
+        conn: Connection,
+        table: str,
+) -> Optional[asyncpg.Record]:
+    query = 'SELECT count FROM table_counters WHERE table_name = $1'
+    try:
+        return await conn.fetchrow(query, table)
+    except:
+        logger.exception(f'Query {query} failed')
+        raise
+
+
+async def get_estimated_total(
+        conn: Connection,
+        table: str,
+) -> Optional[asyncpg.Record]:
+    query = 'SELECT reltuples::bigint AS count FROM pg_class WHERE oid = $1::regclass'
+    try:
+        return await conn.fetchrow(query, table)
+    except:
+        logger.exception(f'Query {query} failed')
+        raise
+
+
+async def reserve_ids(
+        conn: Connection,
+        table: str,
+        count: int
+) -> List[asyncpg.Record]:
+    """
+    `count` ids taken from the `id` sequence of `table`, with the current utc time
+    """
+    query = QUERIES.get(
+        ('reserve_ids', table),
+        lambda: f"""
+            SELECT nextval(pg_get_serial_sequence('{table}', 'id')) AS id,
+                   (now() at time zone 'utc') AS created_at
+            FROM generate_series(1, $1)
+            """
+    )
+    try:
+        return await conn.fetch(query, count)
+    except:
+        logger.exception(f'Query {query} failed')
+        raise
+
+
+async def copy_records(
+        conn: Connection,
+        table: str,
+        columns: List[str],
+        records: List[Tuple]
+) -> str:
+    try:
+        return await conn.copy_records_to_table(table, records=records, columns=columns)
+    except:
+        logger.exception(f'Copy of {len(records)} records to {table} failed')
+        raise
+
+
+async def fetch(
+        conn: Connection,
+        query: str,
+        *values
+) -> List[asyncpg.Record]:
+    try:
+        return await conn.fetch(query, *values)
+    except:
+        logger.exception(f'Query {query} failed')
+        raise
+
+
+async def execute(
+        conn: Connection,
+        query: str,
+        *values
+) -> str:
+    try:
+        return await conn.execute(query, *values)
+    except:
+        logger.exception(f'Query {query} failed')
+        raise
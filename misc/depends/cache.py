@@ -0,0 +1,14 @@
+import logging
+
+import fastapi
+
+from misc.cache import ModelCache
+
+logger = logging.getLogger(__name__)
+
+
+async def get_post_cache(request: fastapi.Request) -> ModelCache:
+    try:
+        return request.app.state.post_cache
+    except AttributeError:
+        raise RuntimeError('Application state has no post cache')
@@ -1,15 +1,46 @@
 import logging
+
 import fastapi
+
 from misc import db
 
 logger = logging.getLogger(__name__)
 
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
 
-async def get(request: fastapi.Request) -> db.Connection:
+async def get(request: fastapi.Request) -> db.LazyConnection:
+    """
+    primary connection handle, a pool connection is taken per statement.
+    The session dependency shares it, see `misc.depends.session.get` for
+    read-your-writes.
+    """
     try:
         pool = request.app.state.db_pool
     except AttributeError:
         raise RuntimeError("Db pool not found")
     else:
-        async with pool.acquire() as conn:
-            yield conn
+        return db.LazyConnection(pool)
+
+
+async def get_read(request: fastapi.Request) -> db.LazyConnection:
+    """
+    read only connection handle for a replica, or for the primary when no
+    replica is healthy or the session user wrote recently.
+    The pool is picked per statement: the session dependency resolves this
+    before the session is known and FastAPI reuses the handle for the route.
+    """
+    try:
+        replicas = request.app.state.db_replicas
+    except AttributeError:
+        raise RuntimeError("Db replicas not found")
+    else:
+        return db.LazyConnection(lambda: replicas.read_pool(is_sticky(request)))
+
+
+def is_sticky(request: fastapi.Request) -> bool:
+    if (session := getattr(request.state, 'session', None)) is None or not session.user.is_authenticated:
+        return False
+    if session.is_stateless:
+        return request.app.state.db_replicas.is_sticky(session.user.id)
+    return session.is_sticky
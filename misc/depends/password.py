@@ -0,0 +1,14 @@
+import logging
+
+import fastapi
+
+from misc.password import HashPool
+
+logger = logging.getLogger(__name__)
+
+
+async def get(request: fastapi.Request) -> HashPool:
+    try:
+        return request.app.state.password_pool
+    except AttributeError:
+        raise RuntimeError('Application state has no password pool')
@@ -1,18 +1,16 @@
-
-
 from misc import redis
 import logging
 import fastapi
-import asyncpg
 
 logger = logging.getLogger(__name__)
 
 
 async def get(request: fastapi.Request) -> redis.Connection:
+    """
+    shared client, every command takes a connection of its pool and returns
+    it right after
+    """
     try:
-        pool = request.app.state.redis
+        return request.app.state.redis
     except AttributeError:
         raise RuntimeError('Application state has no redis pool')
-    else:
-        async with await pool as conn:
-            yield conn
@@ -1,11 +1,13 @@
 import logging
+from typing import Optional
 
 from fastapi import Request, Response, Security, Depends
 from fastapi.security.api_key import APIKeyQuery, APIKeyHeader, APIKeyCookie
 
-from db.users import get_user
-from misc import db, redis
-from misc.depends.db import get as get_db
+from misc import db, redis, users, tokens, metrics
+from misc.cache import LocalCache
+from misc.replicas import ReplicaSet
+from misc.depends.db import SAFE_METHODS, get as get_db, get_read as get_read_db
 from misc.depends.redis import get as get_redis
 from misc.session import (
     COOKIE_SESSION_NAME,
@@ -22,6 +24,14 @@ from misc.session import (
 
 logger = logging.getLogger(__name__)
 
+REFRESH_WINDOW = 300
+
+SESSION_LOOKUPS = metrics.Counter(
+    'session_lookups_total',
+    'Session keys sent by clients by lookup result: stored (hit) or missing (miss) in redis, valid or invalid token',
+    ['result']
+)
+
 api_key_query = APIKeyQuery(name=TOKEN_SESSION_NAME, auto_error=False)
 api_key_header = APIKeyHeader(name=HEADERS_SESSION_NAME, auto_error=False)
 api_key_cookie = APIKeyCookie(name=COOKIE_SESSION_NAME, auto_error=False)
@@ -30,7 +40,8 @@ api_key_cookie = APIKeyCookie(name=COOKIE_SESSION_NAME, auto_error=False)
 async def get(
         request: Request,
         response: Response,
-        db_conn: db.Connection = Depends(get_db),
+        db_conn: db.Connection = Depends(get_read_db),
+        primary: db.LazyConnection = Depends(get_db),
         redis_conn: redis.Connection = Depends(get_redis),
         api_key_query: str = Security(api_key_query),
         api_key_header: str = Security(api_key_header),
@@ -41,15 +52,24 @@ async def get(
         api_key_header,
         api_key_cookie,
         db_conn,
-        redis_conn
+        redis_conn,
+        request.app.state.user_cache,
+        signed_tokens_secret(request),
+        request.app.state.revocations,
+        primary
     )
     request.state.session = session
     if session.session_type == COOKIE_SESSION:
         response.set_cookie(COOKIE_SESSION_NAME, session.key, max_age=session.max_age)
+    refresh_window = request.app.state.config.get('session', {}).get('refresh_window', REFRESH_WINDOW)
+    if request.method not in SAFE_METHODS:
+        # the route shares the handle: stick before its first statement, the
+        # teardown below runs after the response is sent
+        primary.on_use = lambda: stick_to_primary(session, request.app.state.db_replicas, redis_conn, refresh_window)
 
     yield session
 
-    await save_to_redis(session, redis_conn)
+    await save_to_redis(session, redis_conn, refresh_window)
 
 
 async def get_session(
@@ -57,7 +77,11 @@ async def get_session(
         api_key_header: str,
         api_key_cookie: str,
         db_conn: db.Connection,
-        redis_conn: redis.Connection
+        redis_conn: redis.Connection,
+        user_cache: LocalCache,
+        secret: Optional[str] = None,
+        revocations: Optional[tokens.RevocationList] = None,
+        primary: Optional[db.Connection] = None
 ) -> Session:
     values = [
         [api_key_cookie, COOKIE_SESSION],
@@ -67,9 +91,14 @@ async def get_session(
     session = None
     for key, session_type in values:
         if key:
-            session = await get_from_redis(session_type, key, redis_conn)
+            if secret and session_type != COOKIE_SESSION and tokens.is_signed(key):
+                session = get_from_token(session_type, key, secret, revocations)
+                SESSION_LOOKUPS.inc('token_valid' if session is not None else 'token_invalid')
+            else:
+                session = await get_from_redis(session_type, key, redis_conn)
+                SESSION_LOOKUPS.inc('hit' if session is not None else 'miss')
             if session is not None:
-                session = await get_session_user(session, db_conn)
+                session = await get_session_user(session, db_conn, user_cache, primary)
                 return session
 
     return Session(
@@ -78,26 +107,78 @@ async def get_session(
 
 
 async def get_from_redis(session_type: SessionType, key: str, redis_conn: redis.Connection) -> Session:
-    data = await redis.get(cache_key(key), redis_conn)
+    data, ttl = await redis.get_with_ttl(cache_key(key), redis_conn)
     if data is None:
         return None
     session = Session(
         session_type=session_type,
         key=key,
-        data=data
+        data=data,
+        ttl=max(ttl, 0)
     )
     return session
 
 
-async def save_to_redis(session: Session, redis_conn: redis.Connection):
-    await redis.setex(
-        cache_key(session.key),
-        session.max_age,
-        session.data,
-        redis_conn
+def get_from_token(
+        session_type: SessionType,
+        key: str,
+        secret: str,
+        revocations: tokens.RevocationList
+) -> Optional[Session]:
+    if (user_id := tokens.verify(key, secret, revocations)) is None:
+        return None
+    return Session(
+        session_type=session_type,
+        key=key,
+        data={'user_id': user_id},
+        stateless=True
     )
 
 
+async def save_to_redis(session: Session, redis_conn: redis.Connection, refresh_window: int = REFRESH_WINDOW):
+    """
+    Changed sessions are rewritten, a session left without data is removed or
+    never stored (anonymous visitors), an unchanged one only gets its expiry
+    pushed back once it is older than `refresh_window` seconds.
+    """
+    if session.is_stateless:
+        return
+    if session.is_dirty:
+        if session.is_empty:
+            if session.is_stored:
+                await remove_from_redis(session, redis_conn)
+            return
+        await redis.setex(
+            cache_key(session.key),
+            session.max_age,
+            session.data,
+            redis_conn
+        )
+    elif session.is_stored and session.max_age - session.ttl > refresh_window:
+        await redis.expire(cache_key(session.key), session.max_age, redis_conn)
+
+
+async def stick_to_primary(
+        session: Session,
+        replicas: ReplicaSet,
+        redis_conn: redis.Connection,
+        refresh_window: int = REFRESH_WINDOW
+):
+    """
+    Reads of the session user go to the primary for the sticky window, so
+    they see their own writes before replicas catch up. Stored sessions are
+    saved right away. Stateless ones (signed tokens) are only marked in this
+    worker's `ReplicaSet.sticky_users`, other workers may read from a replica.
+    """
+    if not session.user.is_authenticated:
+        return
+    if session.is_stateless:
+        replicas.stick(session.user.id)
+        return
+    session.stick_to_primary(replicas.sticky_window)
+    await save_to_redis(session, redis_conn, refresh_window)
+
+
 async def remove_from_redis(session: Session, redis_conn: redis.Connection):
     await redis.del_(
         cache_key(session.key),
@@ -105,13 +186,45 @@ async def remove_from_redis(session: Session, redis_conn: redis.Connection):
     )
 
 
-async def get_session_user(session: Session, db_conn: db.Connection) -> Session:
+async def get_session_user(
+        session: Session,
+        db_conn: db.Connection,
+        user_cache: LocalCache,
+        primary: Optional[db.Connection] = None
+) -> Session:
+    """
+    `db_conn` may be a replica, a user it does not have yet (just signed up)
+    is looked up on the `primary`. Disabled users stay anonymous.
+    """
     if session.session_user_id:
-        user = await get_user(db_conn, session.session_user_id)
-        if user is not None:
+        user = await users.get_user(session.session_user_id, user_cache, db_conn)
+        if user is None and primary is not None:
+            user = await users.get_user(session.session_user_id, user_cache, primary)
+        if user is not None and user.en is not False:
             session.set_user(user)
     return session
 
 
+def signed_tokens_secret(request: Request) -> Optional[str]:
+    return request.app.state.config.get('session', {}).get('signed_tokens', {}).get('secret')
+
+
+async def session_token(session: Session, request: Request, redis_conn: redis.Connection) -> str:
+    """
+    Token to return to the client: a signed token for an authenticated user
+    when signed tokens are enabled, the session key otherwise.
+    """
+    if session.is_stateless or not session.user.is_authenticated:
+        return session.key
+    if not (secret := signed_tokens_secret(request)):
+        return session.key
+    return tokens.sign(
+        session.user.id,
+        await request.app.state.revocations.current_epoch(session.user.id, redis_conn),
+        secret,
+        request.app.state.config['session']['signed_tokens'].get('ttl', tokens.TTL)
+    )
+
+
 def cache_key(key: str) -> str:
     return f'session_{key}'
@@ -0,0 +1,67 @@
+"""
+JSON encoding shared by API responses, redis values and postgres jsonb.
+Uses orjson when it is installed and the standard json module otherwise.
+"""
+import json
+import logging
+from typing import Any, Type
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, separators=(',', ':'), default=jsonable_encoder).encode()
+
+
+def dumps_str(value: Any) -> str:
+    return dumps(value).decode()
+
+
+def loads(data: Any) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def response_class(fast: bool = True) -> Type[JSONResponse]:
+    if fast and orjson is not None:
+        return ORJSONResponse
+    return JSONResponse
+
+
+def configure(fast: bool = True) -> Type[JSONResponse]:
+    """
+    Sets APIResponse, used for responses built outside routes (misc.handlers),
+    returns it for the app's default_response_class.
+    """
+    global APIResponse
+    APIResponse = response_class(fast)
+    return APIResponse
+
+
+def model_response(model: BaseModel, status_code: int = 200) -> JSONResponse:
+    """
+    Response for a model the route built from trusted data. FastAPI passes a
+    returned model through .dict(), response_model validation and
+    jsonable_encoder; a returned response skips all three. orjson encodes the
+    .dict() as is, the stdlib needs jsonable_encoder for dates.
+    Only return models of the route's response_model class, it still
+    documents the schema but no longer filters fields.
+    """
+    if APIResponse is ORJSONResponse:
+        return APIResponse(model.dict(), status_code)
+    return APIResponse(jsonable_encoder(model), status_code)
+
+
+APIResponse = response_class()
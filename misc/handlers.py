@@ -13,6 +13,7 @@ from fastapi.exceptions import RequestValidationError
 from fastapi.responses import JSONResponse
 from starlette.exceptions import HTTPException as StarletteHTTPException
 
+from misc import encoding
 from models.base import (
     ValidationError,
     ErrorResponse,
@@ -29,41 +30,49 @@ class ForbiddenException(Exception):
 
 
 async def error_409(errors: List[Any]):
-    return JSONResponse(status_code=409, content=UpdateErrorResponse(errors=errors).json())
+    return encoding.APIResponse(status_code=409, content=UpdateErrorResponse(errors=errors).dict())
 
 
 async def ok_204() -> JSONResponse:
-    return JSONResponse(status_code=204)
+    return encoding.APIResponse(status_code=204)
 
 
 async def error_500(detail: Optional[str] = None, debug: Optional[str] = None) -> JSONResponse:
-    return JSONResponse(status_code=500,
-                        content=ErrorResponse(error=detail or 'Server internal fatal_error', debug=debug).dict())
+    return encoding.APIResponse(status_code=500,
+                                content=ErrorResponse(error=detail or 'Server internal fatal_error', debug=debug).dict())
 
 
 async def error_400_with_detail(detail: Optional[str] = None, debug: Optional[str] = None) -> JSONResponse:
-    return JSONResponse(status_code=400,
-                        content=ErrorResponse(error=detail or 'Wrong request data', debug=debug).dict())
+    return encoding.APIResponse(status_code=400,
+                                content=ErrorResponse(error=detail or 'Wrong request data', debug=debug).dict())
 
 
 async def error_404(message: Optional[str] = None) -> JSONResponse:
-    return JSONResponse(status_code=404, content=ErrorResponse(error=message or 'not found').dict())
+    return encoding.APIResponse(status_code=404, content=ErrorResponse(error=message or 'not found').dict())
 
 
 async def error_401(message: Optional[str] = None) -> JSONResponse:
-    return JSONResponse(status_code=401, content=ErrorResponse(error=message or 'unauthorized').dict())
+    return encoding.APIResponse(status_code=401, content=ErrorResponse(error=message or 'unauthorized').dict())
 
 
 async def error_403(message: Optional[str] = None) -> JSONResponse:
-    return JSONResponse(status_code=403, content=ErrorResponse(error=message or 'forbidden').dict())
+    return encoding.APIResponse(status_code=403, content=ErrorResponse(error=message or 'forbidden').dict())
 
 
 async def error_400(message: Optional[str] = None) -> JSONResponse:
-    return JSONResponse(status_code=400, content=ErrorResponse(error=message or 'invalid input data').dict())
+    return encoding.APIResponse(status_code=400, content=ErrorResponse(error=message or 'invalid input data').dict())
+
+
+async def error_503(message: Optional[str] = None, retry_after: int = 1) -> JSONResponse:
+    return encoding.APIResponse(
+        status_code=503,
+        content=ErrorResponse(error=message or 'service is busy, retry later').dict(),
+        headers={'Retry-After': str(retry_after)}
+    )
 
 
 async def error_400_with_content(content: Dict) -> JSONResponse:
-    return JSONResponse(status_code=400, content=content)
+    return encoding.APIResponse(status_code=400, content=content)
 
 
 def register_exception_handler(app: FastAPI):
@@ -90,7 +99,7 @@ def register_exception_handler(app: FastAPI):
                     )
                 )
 
-        return JSONResponse(
+        return encoding.APIResponse(
             status_code=400,
             content=ErrorResponse(
                 error='Client sent incomplete data',
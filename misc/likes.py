@@ -0,0 +1,372 @@
+import asyncio
+import contextlib
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List, Tuple, Optional, Dict
+
+import asyncpg
+from redis.asyncio.lock import Lock
+from redis.exceptions import LockNotOwnedError
+
+from db import likes as likes_db
+from misc import db, redis
+
+logger = logging.getLogger(__name__)
+
+LEGACY_PREFIX = 'post_'
+
+DIRTY_KEY = 'likes_dirty'
+FLUSHING_KEY = 'likes_flushing'
+BATCHES_KEY = 'likes_flushing_batches'
+FLUSH_LOCK_KEY = 'likes_flush_lock'
+FLUSH_INTERVAL = 1
+FLUSH_CHUNK = 1000
+
+TTL_MS = 7 * 24 * 3600 * 1000
+
+EPOCH = datetime(1970, 1, 1)
+
+# marks a likes set as loaded, so a post without likes is not a cache miss;
+# scored 0 to stay below every like and skipped by the (0 +inf ranges
+LOADED = '-'
+
+# likes of a post are a sorted set of user ids scored by like time (ms),
+# toggled server side so concurrent likes can't overwrite each other.
+# Every toggle also records the latest state of the (post, user) pair in
+# the DIRTY_KEY hash, the flusher writes those to postgres.
+# Returns {-1, 0} when the set is not loaded from postgres yet.
+TOGGLE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {-1, 0}
+end
+local liked = 0
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+    liked = 1
+end
+redis.call('HSET', KEYS[2], ARGV[3], liked .. ':' .. ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[4])
+return {liked, redis.call('ZCOUNT', KEYS[1], '(0', '+inf')}
+"""
+
+# moves the dirty hash to a batch key of its own and queues the batch
+SEAL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('RPUSH', KEYS[3], KEYS[2])
+return 1
+"""
+
+
+async def init(
+        post_id: int,
+        conn: redis.Connection
+):
+    await init_many([post_id], conn)
+
+
+async def init_many(
+        post_ids: List[int],
+        conn: redis.Connection
+):
+    """
+    Empty loaded likes sets for new posts, in one round trip.
+    """
+    commands = []
+    for i in post_ids:
+        commands.append(('ZADD', cache_key(i), 0, LOADED))
+        commands.append(('PEXPIRE', cache_key(i), TTL_MS))
+    if commands:
+        await redis.pipelined(commands, conn)
+
+
+async def toggle(
+        post_id: int,
+        user_id: int,
+        conn: redis.Connection,
+        db_conn: db.Connection
+) -> Tuple[bool, int]:
+    """
+    Like or unlike `post_id` for `user_id` in one round trip.
+    Returns whether the user likes the post now and the new likes count.
+    """
+    for _ in range(2):
+        liked, count = await redis.eval_script(
+            TOGGLE_SCRIPT,
+            keys=[cache_key(post_id), DIRTY_KEY],
+            args=[user_id, now_ms(), dirty_field(post_id, user_id), TTL_MS],
+            conn=conn
+        )
+        if liked >= 0:
+            return bool(liked), count
+        await load([post_id], conn, db_conn)
+    raise RuntimeError(f'Likes of post {post_id} can not be loaded')
+
+
+async def get_likers(
+        post_id: int,
+        conn: redis.Connection,
+        db_conn: db.Connection,
+        offset: int = 0,
+        limit: int = -1
+) -> Tuple[List[int], int]:
+    """
+    Page of likers of `post_id`, newest first, and their total.
+    """
+    for _ in range(2):
+        loaded, likers, total = await redis.pipelined(
+            [
+                ('EXISTS', cache_key(post_id)),
+                ('ZREVRANGEBYSCORE', cache_key(post_id), '+inf', '(0', 'LIMIT', offset, limit),
+                ('ZCOUNT', cache_key(post_id), '(0', '+inf')
+            ],
+            conn
+        )
+        if loaded:
+            return [int(i) for i in likers], total
+        await load([post_id], conn, db_conn)
+    raise RuntimeError(f'Likes of post {post_id} can not be loaded')
+
+
+async def get_stats_many(
+        post_ids: List[int],
+        user_id: Optional[int],
+        conn: redis.Connection,
+        db_conn: db.Connection
+) -> List[Tuple[int, bool]]:
+    """
+    Likes count and whether `user_id` liked it for every post, in one round
+    trip when every set is loaded and one more postgres query otherwise.
+    """
+    commands = []
+    for i in post_ids:
+        commands.append(('EXISTS', cache_key(i)))
+        commands.append(('ZCOUNT', cache_key(i), '(0', '+inf'))
+        commands.append(('ZSCORE', cache_key(i), user_id or LOADED))
+    replies = await redis.pipelined(commands, conn)
+    stats = {}
+    missed = []
+    for idx, post_id in enumerate(post_ids):
+        loaded, count, score = replies[idx * 3: idx * 3 + 3]
+        if loaded:
+            stats[post_id] = (count, bool(user_id) and score is not None)
+        else:
+            missed.append(post_id)
+    if missed:
+        for post_id, likers in (await load(missed, conn, db_conn)).items():
+            stats[post_id] = (len(likers), user_id in likers)
+    return [stats[i] for i in post_ids]
+
+
+async def load(
+        post_ids: List[int],
+        conn: redis.Connection,
+        db_conn: db.Connection
+) -> Dict[int, Dict[int, int]]:
+    """
+    Cold start: fills likes sets of `post_ids` from postgres with one query
+    and one pipeline. Members already present in redis are kept.
+    Returns likers of every post with like time in ms.
+    """
+    likers = {i: {} for i in post_ids}
+    for record in await likes_db.get_likes(db_conn, post_ids):
+        likers[record['post_id']][record['user_id']] = to_ms(record['created_at'])
+    commands = []
+    for post_id, post_likers in likers.items():
+        commands.append((
+            'ZADD', cache_key(post_id), 'NX', 0, LOADED,
+            *[v for user_id, score in post_likers.items() for v in (score, user_id)]
+        ))
+        commands.append(('PEXPIRE', cache_key(post_id), TTL_MS))
+    await redis.pipelined(commands, conn)
+    return likers
+
+
+async def remove(
+        post_id: int,
+        conn: redis.Connection
+):
+    await redis.del_(cache_key(post_id), conn)
+
+
+async def flush(
+        db_pool: asyncpg.Pool,
+        conn: redis.Connection,
+        lock: Optional[Lock] = None
+) -> int:
+    """
+    Writes likes toggled since the last flush to postgres.
+    The dirty hash is renamed to a batch key of its own before reading, so
+    toggles made meanwhile go to the next batch and a flush only ever deletes
+    the batch it wrote. Batches that failed to be written stay listed in
+    BATCHES_KEY and are written first, in order. Returns the number of written pairs.
+    With `lock` every commit first checks the lock is still held and extends
+    it, a flusher that lost it raises LockNotOwnedError without committing.
+    """
+    await redis.eval_script(
+        SEAL_SCRIPT,
+        keys=[DIRTY_KEY, f'{FLUSHING_KEY}:{uuid.uuid4().hex}', BATCHES_KEY],
+        args=[],
+        conn=conn
+    )
+    batches = [i.decode() for i in await conn.lrange(BATCHES_KEY, 0, -1)]
+    if await conn.exists(FLUSHING_KEY):
+        # left by versions that flushed through a single key
+        batches.insert(0, FLUSHING_KEY)
+    flushed = 0
+    for key in batches:
+        flushed += await write_batch(db_pool, conn, key, lock)
+        if lock is not None:
+            await lock.reacquire()
+        async with conn.pipeline(transaction=True) as pipe:
+            await pipe.delete(key).lrem(BATCHES_KEY, 0, key).execute()
+    return flushed
+
+
+async def write_batch(
+        db_pool: asyncpg.Pool,
+        conn: redis.Connection,
+        key: str,
+        lock: Optional[Lock] = None
+) -> int:
+    """
+    Reads the batch in HSCAN chunks of FLUSH_CHUNK pairs, one transaction
+    each. A pair is in a batch once, so chunks do not depend on each other
+    and writing a chunk again is harmless.
+    """
+    written = 0
+    cursor = 0
+    while True:
+        cursor, items = await conn.hscan(key, cursor, count=FLUSH_CHUNK)
+        added, removed = [], []
+        for field, value in items.items():
+            post_id, user_id = map(int, field.split(b':'))
+            liked, score = value.split(b':')
+            if liked == b'1':
+                added.append((post_id, user_id, from_ms(int(score))))
+            else:
+                removed.append((post_id, user_id))
+        async with db.LazyConnection(db_pool).acquire() as db_conn:
+            async with db_conn.transaction():
+                await likes_db.add_likes(db_conn, added)
+                await likes_db.remove_likes(db_conn, removed)
+                if lock is not None:
+                    await lock.reacquire()
+        written += len(added) + len(removed)
+        if not cursor:
+            return written
+
+
+async def run_flusher(
+        db_pool: asyncpg.Pool,
+        conn: redis.Connection,
+        interval: float = FLUSH_INTERVAL
+):
+    """
+    Write-behind loop started with the app, one worker at a time flushes.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await flush_locked(db_pool, conn, interval)
+        except Exception:
+            logger.exception('Likes flush failed')
+
+
+async def stop_flusher(
+        task: asyncio.Task,
+        db_pool: asyncpg.Pool,
+        conn: redis.Connection
+):
+    """
+    Cancels the flusher, waits for it to finish and writes what is still
+    pending. Failures are logged, the rest of the shutdown goes on.
+    """
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+    try:
+        await flush_locked(db_pool, conn)
+    except Exception:
+        logger.exception('Final likes flush failed')
+
+
+async def flush_locked(
+        db_pool: asyncpg.Pool,
+        conn: redis.Connection,
+        interval: float = FLUSH_INTERVAL
+):
+    lock = conn.lock(FLUSH_LOCK_KEY, timeout=max(interval * 10, 30))
+    if not await lock.acquire(blocking=False):
+        return
+    try:
+        if flushed := await flush(db_pool, conn, lock):
+            logger.info(f'Flushed {flushed} likes')
+    except LockNotOwnedError:
+        # the lock expired and another worker may own it, it writes the batch
+        logger.warning('Likes flush lock lost, batch left to the next flush')
+    finally:
+        with contextlib.suppress(LockNotOwnedError):
+            await lock.release()
+
+
+async def migrate_legacy(
+        conn: redis.Connection,
+        batch: int = 500
+) -> int:
+    """
+    Moves `post_{id}` JSON blobs ({"likes": [user_id, ...]}) into likes sets
+    and queues them for the flusher to store in postgres.
+    Users already present in the set keep their score, so it is safe to run
+    while the service is up and to run again after a failure.
+    Returns the number of migrated posts.
+    """
+    migrated = 0
+    async for key in conn.scan_iter(match=f'{LEGACY_PREFIX}*', count=batch):
+        post_id = key.decode()[len(LEGACY_PREFIX):]
+        if not post_id.isdigit():
+            continue
+        post_id = int(post_id)
+        data = await redis.get(key, conn)
+        if data is None:
+            continue
+        likers = data.get('likes') or []
+        score = now_ms()
+        # keep the original list order, the last liker is the newest
+        scores = {user_id: score - len(likers) + idx for idx, user_id in enumerate(likers)}
+        async with conn.pipeline(transaction=True) as pipe:
+            pipe.zadd(cache_key(post_id), {LOADED: 0, **scores}, nx=True)
+            pipe.pexpire(cache_key(post_id), TTL_MS)
+            if scores:
+                pipe.hset(
+                    DIRTY_KEY,
+                    mapping={dirty_field(post_id, user_id): f'1:{ms}' for user_id, ms in scores.items()}
+                )
+            pipe.delete(key)
+            await pipe.execute()
+        migrated += 1
+    return migrated
+
+
+def cache_key(post_id: int) -> str:
+    return f'post_likes_{post_id}'
+
+
+def dirty_field(post_id: int, user_id: int) -> str:
+    return f'{post_id}:{user_id}'
+
+
+def now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def to_ms(value: datetime) -> int:
+    return int((value - EPOCH).total_seconds() * 1000)
+
+
+def from_ms(value: int) -> datetime:
+    return EPOCH + timedelta(milliseconds=value)
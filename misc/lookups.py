@@ -0,0 +1,135 @@
+"""
+Compiles models.base.Lookup filters and order into parameterized SQL for
+misc.db.get_list. Only whitelisted columns, operators and orders are
+accepted, the whitelist of a table should list what its indexes serve, so
+clients can't ask for sequential scans.
+"""
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from models.base import Filter, Lookup, Order, OperatorType, OrderType
+
+logger = logging.getLogger(__name__)
+
+MAX_FILTERS = 5
+MAX_IN_VALUES = 100
+
+INT8_MIN = -2 ** 63
+INT8_MAX = 2 ** 63 - 1
+
+RANGE = (OperatorType.EQ, OperatorType.LT, OperatorType.LTE, OperatorType.GT, OperatorType.GTE)
+
+SQL_OPERATORS = {
+    OperatorType.EQ: '{} = ${}',
+    OperatorType.NEQ: '{} <> ${}',
+    OperatorType.LT: '{} < ${}',
+    OperatorType.LTE: '{} <= ${}',
+    OperatorType.GT: '{} > ${}',
+    OperatorType.GTE: '{} >= ${}',
+    OperatorType.IN: '{} = ANY(${})',
+    OperatorType.LIKE: '{} LIKE ${}',
+    OperatorType.ILIKE: '{} ILIKE ${}',
+    OperatorType.ARRAY: '{} && ${}',
+}
+
+
+class InvalidLookup(ValueError):
+    pass
+
+
+class Column(object):
+    def __init__(self, parse: Callable[[Any], Any], operators: Iterable[OperatorType]):
+        super().__init__()
+        self.parse = parse
+        self.operators = frozenset(operators)
+
+
+def compile_lookup(
+        lookup: Lookup,
+        columns: Dict[str, Column],
+        orders: List[List[str]],
+        first_idx: int = 1
+) -> Tuple[str, List, Optional[List[str]]]:
+    """
+    `where`, its values and the `order` for misc.db.get_list, order is None
+    when the lookup has none. `orders` lists the accepted orders in get_list
+    notation (['-created_at', '-id']).
+    """
+    where, values = compile_filters(lookup.filters, columns, first_idx)
+    return where, values, compile_order(lookup.order, orders)
+
+
+def compile_filters(
+        filters: List[Filter],
+        columns: Dict[str, Column],
+        first_idx: int = 1
+) -> Tuple[str, List]:
+    if len(filters) > MAX_FILTERS:
+        raise InvalidLookup(f'At most {MAX_FILTERS} filters')
+    wheres = []
+    values = []
+    for item in filters:
+        if (column := columns.get(item.field)) is None:
+            raise InvalidLookup(f'Can not filter by {item.field}, allowed: {", ".join(columns)}')
+        if item.operator not in column.operators:
+            raise InvalidLookup(
+                f'Can not filter {item.field} with {item.operator.value}, '
+                f'allowed: {", ".join(sorted(i.value for i in column.operators))}'
+            )
+        values.append(parse_value(item, column))
+        wheres.append(SQL_OPERATORS[item.operator].format(item.field, first_idx + len(values) - 1))
+    return ' AND '.join(wheres), values
+
+
+def compile_order(order: Optional[List[Order]], orders: List[List[str]]) -> Optional[List[str]]:
+    if not order:
+        return None
+    fields = [f'-{i.field}' if i.operator == OrderType.DESC else i.field for i in order]
+    if fields not in orders:
+        raise InvalidLookup(f'Can not order by {",".join(fields)}, allowed: {"; ".join(",".join(i) for i in orders)}')
+    return fields
+
+
+def parse_value(item: Filter, column: Column) -> Any:
+    try:
+        if item.operator in (OperatorType.IN, OperatorType.ARRAY):
+            items = item.value.split(',') if isinstance(item.value, str) else list(item.value)
+            if len(items) > MAX_IN_VALUES:
+                raise InvalidLookup(f'At most {MAX_IN_VALUES} values for {item.field}')
+            return [column.parse(i) for i in items]
+        return column.parse(item.value)
+    except InvalidLookup:
+        raise
+    except (TypeError, ValueError):
+        raise InvalidLookup(f'Invalid value for {item.field}: {item.value}')
+
+
+def int8(value: Any) -> int:
+    """
+    `parse` of bigint columns, postgres would reject values out of its range
+    """
+    value = int(value)
+    if not INT8_MIN <= value <= INT8_MAX:
+        raise ValueError(f'{value} is out of bigint range')
+    return value
+
+
+def parse_filter(text: str) -> Filter:
+    """
+    `field:operator:value` query string notation, the value may contain `:`
+    """
+    try:
+        field, operator, value = text.split(':', 2)
+        return Filter(field=field, operator=OperatorType(operator), value=value)
+    except ValueError:
+        raise InvalidLookup(f'Invalid filter {text}, expected field:operator:value')
+
+
+def parse_order(text: str) -> List[Order]:
+    """
+    comma separated fields, `-` prefix for descending: `-created_at,-id`
+    """
+    return [
+        Order(field=i.lstrip('-'), operator=OrderType.DESC if i.startswith('-') else OrderType.ASC)
+        for i in text.split(',') if i
+    ]
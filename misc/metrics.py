@@ -0,0 +1,136 @@
+import logging
+import threading
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY: List['Metric'] = []
+
+
+class Metric(object):
+    kind = ''
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__()
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}']
+        for label_values, value in self.snapshot():
+            lines.extend(self.samples(label_values, value))
+        return lines
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], float]]:
+        with self._lock:
+            return list(self.values.items())
+
+    def samples(self, label_values: Tuple[str, ...], value) -> List[str]:
+        return [f'{self.name}{self.label_text(label_values)} {value}']
+
+    def label_text(self, label_values: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{k}="{escape(v)}"' for k, v in zip(self.labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *label_values: str, value: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def set_total(self, value: float, *label_values: str):
+        """
+        for running totals counted elsewhere (cache hits), copied at scrape time
+        """
+        self.values[label_values] = value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, description: str, labels: Sequence[str] = ()):
+        super().__init__(name, description, labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def set(self, value: float, *label_values: str):
+        self.values[label_values] = value
+
+    def inc(self, *label_values: str, value: float = 1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + value
+
+    def dec(self, *label_values: str, value: float = 1):
+        self.inc(*label_values, value=-value)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            labels: Sequence[str] = (),
+            buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [count per bucket..., +Inf count, sum]
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *label_values: str):
+        with self._lock:
+            if (series := self.values.get(label_values)) is None:
+                series = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            for idx, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[idx] += 1
+                    break
+            else:
+                series[-2] += 1
+            series[-1] += value
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], List[float]]]:
+        with self._lock:
+            return [(k, list(v)) for k, v in self.values.items()]
+
+    def samples(self, label_values: Tuple[str, ...], value: List[float]) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), value[:-1]):
+            cumulative += count
+            le = f'le="{bound}"'
+            lines.append(f'{self.name}_bucket{self.label_text(label_values, le)} {cumulative}')
+        labels = self.label_text(label_values)
+        lines.append(f'{self.name}_sum{labels} {value[-1]}')
+        lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def render() -> str:
+    """
+    every registered metric in the prometheus text exposition format
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
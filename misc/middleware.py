@@ -0,0 +1,58 @@
+import logging
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from misc import metrics
+
+logger = logging.getLogger(__name__)
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+REQUEST_SECONDS = metrics.Histogram(
+    'http_request_seconds',
+    'Request latency by route template',
+    ['method', 'route', 'status']
+)
+IN_FLIGHT = metrics.Gauge(
+    'http_requests_in_flight',
+    'Requests being handled'
+)
+
+
+class MetricsMiddleware(object):
+    """
+    Plain ASGI middleware: a clock read and a histogram update per request.
+    Routes are labelled by their template (/posts/{post_id}), so the label
+    set stays bounded.
+    """
+
+    def __init__(self, app: ASGIApp):
+        super().__init__()
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            route = scope.get('route')
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - start,
+                scope['method'],
+                route.path if route is not None else UNMATCHED_ROUTE,
+                str(status)
+            )
@@ -1,6 +1,128 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional, Tuple
 
 from passlib.hash import bcrypt
 
+from misc import metrics
 
-async def get_password_hash(password: str, salt: str) -> str:
-    return bcrypt.using(salt=salt).hash(password)
+WORKERS = 2
+QUEUE_SIZE = 32
+
+# checked when the user does not exist, so unknown and known names take
+# the same time; made with the default bcrypt rounds
+DUMMY_HASH = '$2b$12$V5nbgDsmC/TqfNnjr3azo.z4y6xA6VFCLD2bHZUVYJBSQ2.YasZpi'
+
+QUEUE_DEPTH = metrics.Gauge(
+    'password_hash_queue_depth',
+    'Password hashes waiting for or running in the pool'
+)
+HASH_SECONDS = metrics.Histogram(
+    'password_hash_seconds',
+    'Password hash and verify time in the worker process'
+)
+WAIT_SECONDS = metrics.Histogram(
+    'password_hash_wait_seconds',
+    'Time a password hash waited for a free worker process'
+)
+REJECTED = metrics.Counter(
+    'password_hash_rejected_total',
+    'Password hashes rejected because the queue was full'
+)
+
+
+class PoolBusy(Exception):
+    pass
+
+
+class HashPool(object):
+    """
+    bcrypt runs in worker processes so it does not block the event loop.
+    At most `workers + queue_size` calls wait for the pool, more are rejected
+    with PoolBusy.
+    """
+
+    def __init__(self, workers: int = WORKERS, queue_size: int = QUEUE_SIZE):
+        super().__init__()
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        self._capacity = workers + queue_size
+        self._pending = 0
+
+    async def run(self, fn: Callable, *args) -> Any:
+        if self._pending >= self._capacity:
+            REJECTED.inc()
+            raise PoolBusy
+        self._pending += 1
+        QUEUE_DEPTH.set(self._pending)
+        start = time.perf_counter()
+        try:
+            result, seconds = await asyncio.get_running_loop().run_in_executor(self._executor, timed, fn, *args)
+        finally:
+            self._pending -= 1
+            QUEUE_DEPTH.set(self._pending)
+        HASH_SECONDS.observe(seconds)
+        WAIT_SECONDS.observe(max(time.perf_counter() - start - seconds, 0))
+        return result
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def init(config: dict) -> HashPool:
+    return HashPool(
+        config.get('workers', WORKERS),
+        config.get('queue_size', QUEUE_SIZE)
+    )
+
+
+async def get_password_hash(pool: HashPool, password: str) -> str:
+    return await pool.run(hash_password, password)
+
+
+async def verify_password(
+        pool: HashPool,
+        password: str,
+        pass_hash: str,
+        legacy_salt: Optional[str] = None
+) -> Tuple[bool, Optional[str]]:
+    """
+    Checks `password` against the stored hash. For a match on a hash made
+    with the shared `legacy_salt` or outdated settings also returns a fresh
+    hash to store instead.
+    """
+    return await pool.run(check_password, password, pass_hash, legacy_salt)
+
+
+def timed(fn: Callable, *args) -> Tuple[Any, float]:
+    """
+    Runs in the worker process, so the time excludes the wait for a worker
+    """
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def hash_password(password: str) -> str:
+    return bcrypt.hash(password)
+
+
+def check_password(password: str, pass_hash: str, legacy_salt: Optional[str]) -> Tuple[bool, Optional[str]]:
+    if not bcrypt.verify(password, pass_hash):
+        return False, None
+    if bcrypt.needs_update(pass_hash) or is_legacy_hash(pass_hash, legacy_salt):
+        return True, bcrypt.hash(password)
+    return True, None
+
+
+def is_legacy_hash(pass_hash: str, legacy_salt: Optional[str]) -> bool:
+    # "$2b$12$" + 22 chars of salt, the last salt char may be normalized
+    return bool(legacy_salt) and pass_hash[7:28] == legacy_salt[:21]
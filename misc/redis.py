@@ -1,13 +1,17 @@
-import json
 import logging
-from typing import Any
+from typing import Any, Dict, List, Optional, Tuple
 
 from redis.asyncio import from_url, Redis
+from redis.commands.core import AsyncScript
+
+from misc import encoding
 
 logger = logging.getLogger(__name__)
 
 Connection = Redis
 
+_scripts: Dict[str, AsyncScript] = {}
+
 
 async def init(config: dict) -> Connection:
     dsn = config.get('dsn')
@@ -30,14 +34,32 @@ async def get(key: str, conn: Connection) -> dict:
     data = await conn.get(key)
     if data is not None:
         try:
-            return json.loads(data)
+            return encoding.loads(data)
         except:
             logger.exception(f'Wrong session data {data}')
     return None
 
 
+async def get_with_ttl(key: str, conn: Connection) -> Tuple[Optional[dict], int]:
+    """
+    Value and seconds left to live in one round trip, ttl is negative when
+    the key is missing or never expires.
+    """
+    data, ttl = await pipelined([('GET', key), ('TTL', key)], conn)
+    if data is not None:
+        try:
+            return encoding.loads(data), ttl
+        except:
+            logger.exception(f'Wrong session data {data}')
+    return None, ttl
+
+
+async def expire(key: str, ttl: int, conn: Connection):
+    await conn.expire(key, ttl)
+
+
 async def set(key: str, value: Any, conn: Connection):
-    await conn.set(key, json.dumps(value))
+    await conn.set(key, encoding.dumps(value))
 
 
 async def del_(key: str, conn: Connection):
@@ -45,4 +67,23 @@ async def del_(key: str, conn: Connection):
 
 
 async def setex(key: str, ttl: int, value: Any, conn: Connection):
-    await conn.setex(key, ttl, json.dumps(value))
+    await conn.setex(key, ttl, encoding.dumps(value))
+
+
+async def eval_script(source: str, keys: List[str], args: List[Any], conn: Connection) -> Any:
+    if (script := _scripts.get(source)) is None:
+        script = _scripts[source] = conn.register_script(source)
+    return await script(keys=keys, args=args, client=conn)
+
+
+async def pipelined(commands: List[Tuple[Any, ...]], conn: Connection) -> List[Any]:
+    """
+    Runs `commands` ((name, *args) tuples) in a single round trip, without
+    MULTI, returning replies in the same order.
+    """
+    if not commands:
+        return []
+    async with conn.pipeline(transaction=False) as pipe:
+        for command in commands:
+            pipe.execute_command(*command)
+        return await pipe.execute()
@@ -0,0 +1,137 @@
+import asyncio
+import itertools
+import logging
+from typing import Any, Dict, List, Optional
+
+import asyncpg
+
+from misc import db
+from misc.cache import LocalCache, MISSING
+
+logger = logging.getLogger(__name__)
+
+ROUND_ROBIN = 'round_robin'
+LEAST_CONNECTIONS = 'least_connections'
+
+HEALTH_INTERVAL = 5
+HEALTH_TIMEOUT = 1
+STICKY_WINDOW = 5
+
+LAG_QUERY = 'SELECT coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)'
+
+
+class Replica(object):
+    def __init__(self, name: str, pool: asyncpg.Pool):
+        super().__init__()
+        self.name = name
+        self.pool = pool
+        self.healthy = True
+        self.lag: Optional[float] = None
+
+    @property
+    def in_use(self) -> int:
+        return self.pool.get_size() - self.pool.get_idle_size()
+
+
+class ReplicaSet(object):
+    """
+    Primary pool plus read replicas. Reads go to a healthy replica picked
+    round robin or by the fewest connections in use, and to the primary when
+    no replica is healthy or the reader asks for it (read-your-writes).
+    Stickiness is kept in the session, `sticky_users` is the process local
+    fallback for sessions that are not stored (signed tokens).
+    """
+
+    def __init__(
+            self,
+            primary: asyncpg.Pool,
+            replicas: List[Replica] = (),
+            strategy: str = ROUND_ROBIN,
+            max_lag: Optional[float] = None,
+            health_timeout: float = HEALTH_TIMEOUT,
+            sticky_window: float = STICKY_WINDOW
+    ):
+        super().__init__()
+        if strategy not in (ROUND_ROBIN, LEAST_CONNECTIONS):
+            raise ValueError(f'Unknown replica strategy {strategy}')
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.max_lag = max_lag
+        self.health_timeout = health_timeout
+        self.sticky_window = sticky_window
+        self.sticky_users = LocalCache(10000, sticky_window)
+        self._counter = itertools.count()
+        self.primary_reads = 0
+        self.replica_reads = 0
+
+    def read_pool(self, primary: bool = False) -> asyncpg.Pool:
+        healthy = [i for i in self.replicas if i.healthy] if not primary else []
+        if not healthy:
+            self.primary_reads += 1
+            return self.primary
+        self.replica_reads += 1
+        if self.strategy == LEAST_CONNECTIONS:
+            return min(healthy, key=lambda i: i.in_use).pool
+        return healthy[next(self._counter) % len(healthy)].pool
+
+    def stick(self, user_id: int):
+        self.sticky_users.set(user_id, True)
+
+    def is_sticky(self, user_id: int) -> bool:
+        return self.sticky_users.get(user_id) is not MISSING
+
+    async def check(self):
+        for replica in self.replicas:
+            healthy = await self.check_replica(replica)
+            if healthy != replica.healthy:
+                logger.warning(f'Replica {replica.name} is {"healthy" if healthy else "unhealthy"}, lag {replica.lag}')
+            replica.healthy = healthy
+
+    async def check_replica(self, replica: Replica) -> bool:
+        try:
+            replica.lag = await db.LazyConnection(replica.pool).fetchval(LAG_QUERY, timeout=self.health_timeout)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception(f'Replica {replica.name} health check failed')
+            replica.lag = None
+            return False
+        return self.max_lag is None or replica.lag <= self.max_lag
+
+    async def run_health_checks(self, interval: float = HEALTH_INTERVAL):
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    async def close(self):
+        for replica in self.replicas:
+            await db.close(replica.pool)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'primary_reads': self.primary_reads,
+            'replica_reads': self.replica_reads,
+            'replicas': {
+                i.name: {'healthy': i.healthy, 'lag': i.lag, 'in_use': i.in_use}
+                for i in self.replicas
+            }
+        }
+
+
+async def init(primary: asyncpg.Pool, config: dict) -> ReplicaSet:
+    """
+    `config` is the `db` section, replicas use its pool settings with their own dsn
+    """
+    replicas_config = config.get('replicas', {})
+    replicas = []
+    for idx, dsn in enumerate(replicas_config.get('dsns', [])):
+        replicas.append(Replica(f'replica{idx}', await db.init({**config, 'dsn': dsn})))
+    return ReplicaSet(
+        primary,
+        replicas,
+        replicas_config.get('strategy', ROUND_ROBIN),
+        replicas_config.get('max_lag'),
+        replicas_config.get('health_timeout', HEALTH_TIMEOUT),
+        replicas_config.get('sticky_window', STICKY_WINDOW)
+    )
@@ -1,5 +1,6 @@
 import logging
 import secrets
+import time
 import typing
 
 from models.users import BaseUser, Anonymous
@@ -27,7 +28,9 @@ class Session(object):
             self,
             session_type: typing.Optional[SessionType] = None,
             key: typing.Optional[str] = None,
-            data: typing.Optional[dict] = None
+            data: typing.Optional[dict] = None,
+            ttl: typing.Optional[int] = None,
+            stateless: bool = False
     ):
         super().__init__()
         self.reset_user()
@@ -35,6 +38,11 @@ class Session(object):
             self._data = data
         self._key: str = key or new_key()
         self._session_type: SessionType = session_type or COOKIE_SESSION
+        # seconds left in storage when loaded, None for a new session
+        self._ttl: typing.Optional[int] = ttl
+        self._dirty: bool = False
+        # signed token session, nothing to store
+        self._stateless: bool = stateless
 
     @property
     def user(self) -> BaseUser:
@@ -42,11 +50,49 @@ class Session(object):
 
     def set_user(self, user: BaseUser):
         self._user = user
-        self._data['user_id'] = user.id
+        if self._data.get('user_id') != user.id:
+            self._data['user_id'] = user.id
+            self.mark_dirty()
 
     def reset_user(self):
         self._user: BaseUser = Anonymous()
         self._data: dict = {'user_id': None}
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def stick_to_primary(self, window: float):
+        """
+        reads of the next `window` seconds go to the primary db, so the user
+        sees their own writes before replicas catch up
+        """
+        self._data['primary_until'] = time.time() + window
+        self.mark_dirty()
+
+    @property
+    def is_sticky(self) -> bool:
+        return self._data.get('primary_until', 0) > time.time()
+
+    @property
+    def is_dirty(self) -> bool:
+        return self._dirty
+
+    @property
+    def is_stateless(self) -> bool:
+        return self._stateless
+
+    @property
+    def is_stored(self) -> bool:
+        return self._ttl is not None
+
+    @property
+    def is_empty(self) -> bool:
+        return not any(self._data.values())
+
+    @property
+    def ttl(self) -> typing.Optional[int]:
+        return self._ttl
 
     @property
     def key(self):
@@ -0,0 +1,70 @@
+import logging
+from typing import List, Optional
+
+from db import posts as posts_db
+from misc import db, redis, encoding
+from models.posts import Post
+
+logger = logging.getLogger(__name__)
+
+FIRST_PAGE_SIZE = 20
+TTL = 60
+
+
+async def get_first_page(
+        author_id: int,
+        conn: redis.Connection,
+        db_conn: db.Connection,
+        ttl: int = TTL
+) -> List[Post]:
+    """
+    Newest FIRST_PAGE_SIZE posts of the author, cached in redis until one of
+    them changes (see `invalidate`) or `ttl` passes. Load it from the primary,
+    a lagging replica would put a stale page in the cache.
+    The page is stored with the author's version read before loading it: a
+    page loaded before a concurrent change is written with the old version
+    and ignored, instead of pinning stale posts for the ttl.
+    """
+    version, data = await conn.mget(version_key(author_id), cache_key(author_id))
+    version = int(version or 0)
+    if data is not None and (cached := encoding.loads(data))['version'] == version:
+        return [Post.parse_obj(i) for i in cached['items']]
+    page = await posts_db.get_author_posts(db_conn, author_id, FIRST_PAGE_SIZE)
+    await conn.setex(
+        cache_key(author_id),
+        ttl,
+        encoding.dumps({'version': version, 'items': [i.dict() for i in page]})
+    )
+    return page
+
+
+async def get_page(
+        author_id: int,
+        limit: int,
+        after: Optional[str],
+        conn: redis.Connection,
+        db_conn: db.Connection,
+        primary_conn: db.Connection,
+        ttl: int = TTL
+) -> List[Post]:
+    """
+    The first page of the default size comes from the cache, others from `db_conn`
+    """
+    if after is None and limit == FIRST_PAGE_SIZE:
+        return await get_first_page(author_id, conn, primary_conn, ttl)
+    return await posts_db.get_author_posts(db_conn, author_id, limit, after)
+
+
+async def invalidate(author_id: int, conn: redis.Connection):
+    """
+    Call after a post of the author is created, changed or deleted
+    """
+    await conn.incr(version_key(author_id))
+
+
+def cache_key(author_id: int) -> str:
+    return f'author_posts_{author_id}'
+
+
+def version_key(author_id: int) -> str:
+    return f'author_posts_version_{author_id}'
@@ -0,0 +1,111 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import time
+from typing import Optional, Dict
+
+from misc import redis
+
+logger = logging.getLogger(__name__)
+
+REVOCATIONS_KEY = 'session_revocations'
+
+TTL = 2592000
+REFRESH_INTERVAL = 30
+
+
+class RevocationList(object):
+    """
+    Process copy of the per-user revocation epochs kept in redis.
+    Tokens signed with an epoch below the current one of their user are
+    revoked, so revoking bumps the epoch and drops every token of the user.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._epochs: Dict[int, int] = {}
+
+    def epoch(self, user_id: int) -> int:
+        return self._epochs.get(user_id, 0)
+
+    def is_revoked(self, user_id: int, epoch: int) -> bool:
+        return epoch < self.epoch(user_id)
+
+    async def current_epoch(self, user_id: int, conn: redis.Connection) -> int:
+        """
+        Epoch read from redis, sign new tokens with it: the process copy misses
+        revocations made by other workers since the last refresh.
+        """
+        epoch = int(await conn.hget(REVOCATIONS_KEY, user_id) or 0)
+        if epoch > self.epoch(user_id):
+            self._epochs[user_id] = epoch
+        return epoch
+
+    async def refresh(self, conn: redis.Connection):
+        self._epochs = {int(k): int(v) for k, v in (await conn.hgetall(REVOCATIONS_KEY)).items()}
+
+    async def revoke(self, user_id: int, conn: redis.Connection):
+        self._epochs[user_id] = await conn.hincrby(REVOCATIONS_KEY, user_id, 1)
+
+    async def run_refresher(self, conn: redis.Connection, interval: float = REFRESH_INTERVAL):
+        while True:
+            try:
+                await self.refresh(conn)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Revocation list refresh failed')
+            await asyncio.sleep(interval)
+
+
+def sign(user_id: int, epoch: int, secret: str, ttl: int = TTL) -> str:
+    """
+    Compact `payload.signature` token, the payload carries the user id,
+    expiry time and revocation epoch.
+    """
+    payload = encode(json.dumps(
+        {'u': user_id, 'e': int(time.time()) + ttl, 'v': epoch},
+        separators=(',', ':')
+    ).encode())
+    return f'{payload}.{signature(payload, secret)}'
+
+
+def verify(token: str, secret: str, revocations: RevocationList) -> Optional[int]:
+    """
+    User id of a valid, not expired and not revoked token, None otherwise.
+    Does not do any I/O.
+    """
+    payload, _, token_signature = token.partition('.')
+    if not token_signature or not hmac.compare_digest(
+            token_signature.encode(),
+            signature(payload, secret).encode()
+    ):
+        return None
+    try:
+        claims = json.loads(decode(payload))
+        user_id, expires, epoch = int(claims['u']), claims['e'], claims['v']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        return None
+    if expires < time.time() or revocations.is_revoked(user_id, epoch):
+        return None
+    return user_id
+
+
+def is_signed(token: str) -> bool:
+    return '.' in token
+
+
+def signature(payload: str, secret: str) -> str:
+    return encode(hmac.new(secret.encode(), payload.encode(), hashlib.sha256).digest())
+
+
+def encode(value: bytes) -> str:
+    return base64.urlsafe_b64encode(value).decode().rstrip('=')
+
+
+def decode(value: str) -> bytes:
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
@@ -0,0 +1,86 @@
+import asyncio
+import logging
+from typing import Optional
+
+from db import users as users_db
+from misc import db, redis
+from misc.cache import LocalCache, MISSING
+from models.users import User
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = 'users_invalidate'
+
+CACHE_SIZE = 10000
+CACHE_TTL = 30
+
+
+def init_cache(config: dict) -> LocalCache:
+    return LocalCache(
+        config.get('size', CACHE_SIZE),
+        config.get('ttl', CACHE_TTL)
+    )
+
+
+async def get_user(
+        user_id: int,
+        cache: LocalCache,
+        db_conn: db.Connection
+) -> Optional[User]:
+    """
+    Snapshot of the user from the process cache, postgres on a miss.
+    """
+    if (user := cache.get(user_id)) is MISSING:
+        if (user := await users_db.get_user(db_conn, user_id)) is None:
+            return None
+        cache.set(user_id, user)
+    return user.copy()
+
+
+async def update(
+        user_id: int,
+        data: dict,
+        cache: LocalCache,
+        db_conn: db.Connection,
+        conn: redis.Connection
+) -> Optional[User]:
+    """
+    Changes the users row and drops its snapshots, None if there is no such user.
+    """
+    if (user := await users_db.update_user(db_conn, user_id, data)) is not None:
+        await invalidate(user_id, cache, conn)
+    return user
+
+
+async def invalidate(
+        user_id: int,
+        cache: LocalCache,
+        conn: redis.Connection
+):
+    """
+    Call after a users row changes: drops the snapshot here and in every
+    worker listening on INVALIDATE_CHANNEL.
+    """
+    cache.delete(user_id)
+    await conn.publish(INVALIDATE_CHANNEL, user_id)
+
+
+async def listen_invalidations(
+        cache: LocalCache,
+        conn: redis.Connection,
+        retry_interval: float = 1
+):
+    while True:
+        try:
+            async with conn.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATE_CHANNEL)
+                # snapshots could change while we were not subscribed
+                cache.clear()
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        cache.delete(int(message['data']))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception('Users invalidation listener failed')
+            await asyncio.sleep(retry_interval)
@@ -1,7 +1,7 @@
 from datetime import datetime
-from typing import Optional
+from typing import Any, List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, constr, validator
 
 from models.base import SuccessResponse, ListData
 
@@ -12,18 +12,76 @@ class Post(BaseModel):
     body: str
     created_at: datetime
     author_id: int
-    likes: Optional[list[int]] = []
+    likes_count: int = 0
+    liked_by_me: bool = False
+
+
+class SearchPost(Post):
+    snippet: str
+    rank: float
+
+
+class PostsSearchData(BaseModel):
+    items: list[SearchPost]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class PostsSearchSuccessResponse(SuccessResponse):
+    data: PostsSearchData
+
+
+class AuthorPostsData(BaseModel):
+    items: list[Post]
+    limit: int
+    next_cursor: Optional[str] = None
+
+
+class AuthorPostsSuccessResponse(SuccessResponse):
+    data: AuthorPostsData
+
+
+def no_nul(value: Optional[str]) -> Optional[str]:
+    # postgres text can't hold NUL, it would fail the statement (the whole COPY of a batch)
+    if value is not None and '\x00' in value:
+        raise ValueError('NUL characters are not allowed')
+    return value
 
 
 class NewPost(BaseModel):
-    title: str
+    title: constr(max_length=255)
     body: str
 
+    _no_nul = validator('title', 'body', allow_reuse=True)(no_nul)
+
+
+class NewPostsBatch(BaseModel):
+    # items are validated one by one, an invalid one (even not an object) does not fail the batch
+    items: List[Any]
+
+
+class BatchItemResult(BaseModel):
+    index: int
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+
+class PostsBatchData(BaseModel):
+    created: int
+    failed: int
+    items: list[BatchItemResult]
+
+
+class PostsBatchSuccessResponse(SuccessResponse):
+    data: PostsBatchData
+
 
 class UpdatePost(BaseModel):
     title: Optional[str]
     body: Optional[str]
 
+    _no_nul = validator('title', 'body', allow_reuse=True)(no_nul)
+
 
 class PostSuccessResponse(SuccessResponse):
     data: Post
@@ -31,7 +89,17 @@ class PostSuccessResponse(SuccessResponse):
 
 class PostsListData(ListData):
     items: list[Post]
+    next_cursor: Optional[str] = None
+    total_mode: str
 
 
 class PostsListSuccessResponse(SuccessResponse):
     data: PostsListData
+
+
+class LikersListData(ListData):
+    items: list[int]
+
+
+class LikersListSuccessResponse(SuccessResponse):
+    data: LikersListData
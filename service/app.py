@@ -5,11 +5,20 @@ from misc.depends.session import get as get_session
 from misc import (
     db,
     ctrl,
-    redis
+    redis,
+    likes,
+    users,
+    tokens,
+    password,
+    encoding,
+    replicas
 )
+from misc.cache import ModelCache
 from misc.handlers import register_exception_handler
+from misc.middleware import MetricsMiddleware
 from models.base import ErrorResponse, UpdateErrorResponse
-from service.routers import register_routers
+from models.posts import Post
+from service.routers import register_routers, posts as posts_router
 from service.state import State
 import logging
 
@@ -30,10 +39,18 @@ def main(args, config: dict) -> FastAPI:
         debug=config.get('debug', False),
         root_path=config.get("root_path", None),
         responses=responses(),
-        dependencies=[Depends(get_session)]
+        dependencies=[Depends(get_session)],
+        default_response_class=encoding.configure(config.get('fast_json', True))
     )
     app.state = state
     state.app = app
+    state.post_cache = ModelCache.from_config('post_cache', Post, config.get('cache', {}).get('posts', {}))
+    state.user_cache = users.init_cache(config.get('cache', {}).get('users', {}))
+    state.revocations = tokens.RevocationList()
+    state.export_slots = asyncio.Semaphore(
+        config.get('posts', {}).get('export_concurrency', posts_router.EXPORT_CONCURRENCY)
+    )
+    app.add_middleware(MetricsMiddleware)
     register_exception_handler(app)
     register_routers(app)
     register_shutdown(app)
@@ -61,11 +78,53 @@ def register_startup(app: FastAPI):
 
 
 async def startup(app: FastAPI):
+    app.state.password_pool = password.init(app.state.config.get('password', {}))
     app.state.db_pool = await db.init(app.state.config['db'])
+    app.state.db_replicas = await replicas.init(app.state.db_pool, app.state.config['db'])
+    if app.state.db_replicas.replicas:
+        app.state.replicas_checker = asyncio.create_task(
+            app.state.db_replicas.run_health_checks(
+                app.state.config['db']['replicas'].get('health_interval', replicas.HEALTH_INTERVAL)
+            )
+        )
     app.state.redis = await redis.init(app.state.config['redis'])
+    app.state.users_listener = asyncio.create_task(
+        users.listen_invalidations(app.state.user_cache, app.state.redis)
+    )
+    if signed_tokens := app.state.config.get('session', {}).get('signed_tokens'):
+        app.state.revocations_refresher = asyncio.create_task(
+            app.state.revocations.run_refresher(
+                app.state.redis,
+                signed_tokens.get('revocations_refresh', tokens.REFRESH_INTERVAL)
+            )
+        )
+    app.state.likes_flusher = asyncio.create_task(
+        likes.run_flusher(
+            app.state.db_pool,
+            app.state.redis,
+            app.state.config.get('likes', {}).get('flush_interval', likes.FLUSH_INTERVAL)
+        )
+    )
 
 
 async def shutdown(app: FastAPI):
+    logger.info(f'Post cache stats {app.state.post_cache.stats()}')
+    logger.info(f'Query text registry stats {db.QUERIES.stats()}')
+    logger.info(f'Prepared statement cache stats {db.statement_cache_stats()}')
+    if app.state.db_replicas:
+        logger.info(f'Db replicas stats {app.state.db_replicas.stats()}')
+    if app.state.replicas_checker:
+        app.state.replicas_checker.cancel()
+    if app.state.users_listener:
+        app.state.users_listener.cancel()
+    if app.state.revocations_refresher:
+        app.state.revocations_refresher.cancel()
+    if app.state.likes_flusher:
+        await likes.stop_flusher(app.state.likes_flusher, app.state.db_pool, app.state.redis)
+    if app.state.password_pool:
+        app.state.password_pool.close()
+    if app.state.db_replicas:
+        await app.state.db_replicas.close()
     if app.state.db_pool:
         await db.close(app.state.db_pool)
     if app.state.redis:
@@ -92,4 +151,7 @@ def responses():
         500: {
             "model": ErrorResponse
         },
+        503: {
+            "model": ErrorResponse
+        },
     }
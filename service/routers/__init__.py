@@ -1,6 +1,6 @@
 from fastapi import APIRouter, FastAPI
 
-from service.routers import auth, posts
+from service.routers import auth, posts, users, metrics
 
 
 def register_routers(app: FastAPI) -> FastAPI:
@@ -9,6 +9,8 @@ def register_routers(app: FastAPI) -> FastAPI:
     )
     router.include_router(auth.router)
     router.include_router(posts.router)
+    router.include_router(users.router)
 
     app.include_router(router)
+    app.include_router(metrics.router)
     return app
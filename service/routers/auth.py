@@ -1,14 +1,17 @@
 import logging
 
 from asyncpg import Connection
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Request
 
 from db import users
 from misc.depends.conf import get as get_conf
+from misc.depends.password import get as get_password_pool
 from misc.depends.db import get as get_db
-from misc.depends.session import get as get_session
-from misc.handlers import error_401, error_404, error_500, error_400
-from misc.password import get_password_hash
+from misc.depends.redis import get as get_redis
+from misc.depends.session import get as get_session, session_token
+from misc import redis, users as user_snapshots
+from misc.handlers import error_401, error_404, error_400, error_503
+from misc.password import get_password_hash, verify_password, HashPool, PoolBusy, DUMMY_HASH
 from misc.session import Session
 from models.auth import MeSuccessResponse, MeResponse, SignIn, SignUp
 
@@ -22,68 +25,93 @@ router = APIRouter(
 
 @router.get("/me", response_model=MeSuccessResponse)
 async def get_me(
-        session: Session = Depends(get_session)
+        request: Request,
+        session: Session = Depends(get_session),
+        cache: redis.Connection = Depends(get_redis)
 ):
     """
     /me returning current user with session key
     """
-    return MeSuccessResponse(data=MeResponse(me=session.user, token=session.key))
+    return MeSuccessResponse(data=MeResponse(me=session.user, token=await session_token(session, request, cache)))
 
 
 @router.post('/sign-in', response_model=MeSuccessResponse)
 async def login(
+        request: Request,
         auth_model: SignIn,
         conn: Connection = Depends(get_db),
         config: dict = Depends(get_conf),
-        session: Session = Depends(get_session)
+        session: Session = Depends(get_session),
+        password_pool: HashPool = Depends(get_password_pool),
+        cache: redis.Connection = Depends(get_redis)
 ):
     if session.user.is_authenticated:
         return await error_401()
 
-    hashed_password = await get_password_hash(auth_model.password, config['salt'])
-    user = await users.get_user_by_creds(conn, auth_model.name, hashed_password)
-    if not user:
-        return error_404()
+    found = await users.get_user_with_hash(conn, auth_model.name)
+    user, pass_hash = found or (None, DUMMY_HASH)
+    try:
+        verified, new_hash = await verify_password(
+            password_pool,
+            auth_model.password,
+            pass_hash,
+            config.get('salt')
+        )
+    except PoolBusy:
+        return await error_503()
+    # an unknown name pays the same hash as a wrong password
+    if not verified or user is None:
+        return await error_404()
+    if new_hash:
+        await users.update_password_hash(conn, user.id, pass_hash, new_hash)
+        await user_snapshots.invalidate(user.id, request.app.state.user_cache, cache)
     session.set_user(user)
-    return MeSuccessResponse(data=MeResponse(me=session.user, token=session.key))
+    return MeSuccessResponse(data=MeResponse(me=session.user, token=await session_token(session, request, cache)))
 
 
 @router.post("/sign-up", response_model=MeSuccessResponse)
 async def register(
+        request: Request,
         reg_model: SignUp,
         conn: Connection = Depends(get_db),
-        config: dict = Depends(get_conf),
-        session: Session = Depends(get_session)
+        session: Session = Depends(get_session),
+        password_pool: HashPool = Depends(get_password_pool),
+        cache: redis.Connection = Depends(get_redis)
 ):
     if session.user.is_authenticated:
         return await error_401()
 
-    if await users.get_user_by_name(
-            conn=conn,
-            name=reg_model.name
-    ):
-        return await error_400("This name already exist")
-
-    hashed_password = await get_password_hash(reg_model.password, config['salt'])
+    try:
+        hashed_password = await get_password_hash(password_pool, reg_model.password)
+    except PoolBusy:
+        return await error_503()
     new_user = await users.create_user(
         conn=conn,
         name=reg_model.name,
         password=hashed_password
     )
     if not new_user:
-        return await error_500()
+        return await error_400("This name already exist")
     session.set_user(new_user)
     return MeSuccessResponse(
         data=MeResponse(
             me=session.user,
-            token=session.key
+            token=await session_token(session, request, cache)
         )
     )
 
 
 @router.post('/logout', response_model=MeSuccessResponse)
 async def logout(
-        session: Session = Depends(get_session)
+        request: Request,
+        session: Session = Depends(get_session),
+        cache: redis.Connection = Depends(get_redis)
 ):
+    """
+    signed tokens can't be dropped one by one, logout revokes every signed
+    token of the user
+    """
+    if session.is_stateless and session.user.is_authenticated:
+        await request.app.state.revocations.revoke(session.user.id, cache)
     session.reset_user()
     return MeSuccessResponse(data=MeResponse(me=session.user, token=session.key))
@@ -0,0 +1,81 @@
+import logging
+
+from fastapi import APIRouter, Request, Response
+
+from misc import db, metrics
+from service.state import State
+
+logger = logging.getLogger(__name__)
+
+DB_POOL_CONNECTIONS = metrics.Gauge(
+    'db_pool_connections',
+    'Connections of a postgres pool by state',
+    ['pool', 'state']
+)
+DB_POOL_MAX = metrics.Gauge(
+    'db_pool_max_connections',
+    'Size limit of a postgres pool',
+    ['pool']
+)
+REDIS_POOL_CONNECTIONS = metrics.Gauge(
+    'redis_pool_connections',
+    'Connections of the redis pool by state',
+    ['state']
+)
+REDIS_POOL_MAX = metrics.Gauge(
+    'redis_pool_max_connections',
+    'Size limit of the redis pool'
+)
+CACHE_HITS = metrics.Counter(
+    'cache_hits_total',
+    'Cache hits by cache and tier',
+    ['cache', 'tier']
+)
+CACHE_MISSES = metrics.Counter(
+    'cache_misses_total',
+    'Cache misses by cache and tier',
+    ['cache', 'tier']
+)
+
+router = APIRouter(
+    tags=["Metrics"]
+)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """
+    prometheus text format, pool and cache figures are read at scrape time
+    """
+    collect(request.app.state)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+def collect(state: State):
+    pools = {'primary': state.db_pool}
+    if state.db_replicas is not None:
+        pools.update({i.name: i.pool for i in state.db_replicas.replicas})
+    for name, pool in pools.items():
+        if pool is None:
+            continue
+        DB_POOL_CONNECTIONS.set(pool.get_size() - pool.get_idle_size(), name, 'in_use')
+        DB_POOL_CONNECTIONS.set(pool.get_idle_size(), name, 'idle')
+        DB_POOL_MAX.set(pool.get_max_size(), name)
+
+    if state.redis is not None:
+        pool = state.redis.connection_pool
+        REDIS_POOL_CONNECTIONS.set(len(pool._in_use_connections), 'in_use')
+        REDIS_POOL_CONNECTIONS.set(len(pool._available_connections), 'idle')
+        REDIS_POOL_MAX.set(pool.max_connections)
+
+    if state.post_cache is not None:
+        stats = state.post_cache.stats()
+        CACHE_HITS.set_total(stats['local_hits'], 'posts', 'local')
+        CACHE_MISSES.set_total(stats['local_misses'], 'posts', 'local')
+        CACHE_HITS.set_total(stats['redis_hits'], 'posts', 'redis')
+        CACHE_MISSES.set_total(stats['redis_misses'], 'posts', 'redis')
+    if state.user_cache is not None:
+        CACHE_HITS.set_total(state.user_cache.hits, 'users', 'local')
+        CACHE_MISSES.set_total(state.user_cache.misses, 'users', 'local')
+    CACHE_HITS.set_total(db.QUERIES.hits, 'query_text', 'local')
+    CACHE_MISSES.set_total(db.QUERIES.misses, 'query_text', 'local')
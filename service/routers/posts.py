@@ -1,23 +1,38 @@
+import asyncio
 import logging
+import time
+from datetime import datetime
+from typing import Optional, List, AsyncGenerator
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
 from db import posts
-from misc import redis
-from misc.db import Connection
-from misc.depends.db import get as get_conn
+from misc import redis, counters, likes, encoding, lookups, timelines
+from misc.cursor import InvalidCursor
+from misc.db import Connection, NotOwnerError
+from misc.cache import ModelCache
+from misc.depends.cache import get_post_cache
+from misc.depends.conf import get as get_conf
+from misc.depends.db import get as get_conn, get_read as get_read_conn
 from misc.depends.redis import get as get_redis
 from misc.depends.session import get as get_session
 from misc.handlers import (
     UnauthenticatedException,
-    error_500, error_404, error_403
+    error_500, error_503, error_404, error_403, error_400
 )
 from misc.session import Session
 from models import posts as posts_models
-from models.base import SuccessResponse
+from models.base import ErrorResponse, SuccessResponse, Lookup
 
 logger = logging.getLogger(__name__)
 
+BATCH_SIZE = 1000
+EXPORT_CHUNK_ROWS = 500
+EXPORT_CONCURRENCY = 4
+EXPORT_TIMEOUT = 300
+
 
 async def check_auth(
         session: Session = Depends(get_session)
@@ -51,57 +66,226 @@ async def create_post(
             new_post=model
     )):
         return await error_500()
-    await redis.set(
-        f"post_{new_post.id}",
-        value={
-            "likes": []
-        },
-        conn=cache
-    )
+    await likes.init(new_post.id, cache)
+    await timelines.invalidate(session.session_user_id, cache)
     return posts_models.PostSuccessResponse(
         data=new_post
     )
 
 
+@router.post("/batch", response_model=posts_models.PostsBatchSuccessResponse)
+async def create_posts_batch(
+        model: posts_models.NewPostsBatch,
+        conn: Connection = Depends(get_conn),
+        session: Session = Depends(get_session),
+        cache: redis.Redis = Depends(get_redis),
+        config: dict = Depends(get_conf)
+):
+    """
+    Create up to `posts:batch_size` (default 1000) posts at once\n
+    every item is validated on its own: invalid items are reported with their
+    index and error, the valid ones are created together\n
+
+    """
+    batch_size = config.get('posts', {}).get('batch_size', BATCH_SIZE)
+    if len(model.items) > batch_size:
+        return await error_400(f'At most {batch_size} posts per batch')
+
+    results = []
+    valid = []
+    for idx, item in enumerate(model.items):
+        try:
+            valid.append((idx, posts_models.NewPost.parse_obj(item)))
+        except ValidationError as e:
+            results.append(posts_models.BatchItemResult(
+                index=idx,
+                error='; '.join(f"{'.'.join(map(str, i['loc']))}: {i['msg']}" for i in e.errors())
+            ))
+    created = await posts.create_posts_bulk(conn, session.session_user_id, [i for _, i in valid])
+    await likes.init_many([i.id for i in created], cache)
+    if created:
+        await timelines.invalidate(session.session_user_id, cache)
+    results.extend(
+        posts_models.BatchItemResult(index=idx, id=post.id)
+        for (idx, _), post in zip(valid, created)
+    )
+    results.sort(key=lambda i: i.index)
+    return posts_models.PostsBatchSuccessResponse(
+        data=posts_models.PostsBatchData(
+            created=len(created),
+            failed=len(results) - len(created),
+            items=results
+        )
+    )
+
+
 @router.get("/", response_model=posts_models.PostsListSuccessResponse)
 async def get_posts(
         page: int = 1,
         limit: int = 20,
-        conn: Connection = Depends(get_conn),
-        cache: redis.Redis = Depends(get_redis)
+        cursor: Optional[str] = None,
+        filters: List[str] = Query([], alias='filter'),
+        order: Optional[str] = None,
+        conn: Connection = Depends(get_read_conn),
+        primary_conn: Connection = Depends(get_conn),
+        session: Session = Depends(get_session),
+        cache: redis.Redis = Depends(get_redis),
+        config: dict = Depends(get_conf)
 ):
     """
-    posts list with pagination\n
+    posts list with pagination, newest first\n
+    pass `next_cursor` of the previous page as `cursor` to fetch the next one,
+    `page` is ignored when `cursor` is set\n
+    `filter` (repeatable) is `field:operator:value`, e.g. `created_at:gte:2026-01-01`,
+    `in` takes comma separated values; `order` is `-created_at,-id` (default) or `created_at,id`.
+    Only indexed columns can be used, others are rejected with 400\n
+    filtered lists report total -1 with total_mode `none`\n
 
     """
 
     limit = max(min(20, limit), 1)
     page = max(page, 1)
 
-    return posts_models.PostsListSuccessResponse(
+    try:
+        lookup = Lookup(
+            filters=[lookups.parse_filter(i) for i in filters],
+            order=lookups.parse_order(order) if order else None
+        )
+        items = await posts.get_posts_list(
+            conn,
+            page,
+            limit,
+            after=cursor,
+            lookup=lookup
+        )
+    except InvalidCursor:
+        return await error_400('Invalid cursor')
+    except lookups.InvalidLookup as e:
+        return await error_400(str(e))
+    if lookup.filters:
+        total, total_mode = -1, counters.NONE
+    else:
+        total, total_mode = await counters.get_total(
+            posts.TABLE,
+            conn,
+            cache,
+            config.get('counters', {})
+        )
+
+    return encoding.model_response(posts_models.PostsListSuccessResponse(
         data=posts_models.PostsListData(
-            items=[
-                await add_post_likes_to_model(cache, i)
-                for i
-                in await posts.get_posts_list(
-                    conn,
-                    page,
-                    limit
-                )
-            ],
+            items=await add_posts_likes_to_models(cache, primary_conn, items, session.session_user_id),
             limit=limit,
             page=page,
-            total=await posts.get_total(conn)
+            total=total,
+            total_mode=total_mode,
+            next_cursor=posts.encode_cursor(items[-1]) if len(items) == limit else None
         )
+    ))
+
+
+@router.get("/search", response_model=posts_models.PostsSearchSuccessResponse)
+async def search_posts(
+        q: str = Query(..., min_length=1, max_length=256),
+        limit: int = 20,
+        cursor: Optional[str] = None,
+        conn: Connection = Depends(get_read_conn),
+        primary_conn: Connection = Depends(get_conn),
+        session: Session = Depends(get_session),
+        cache: redis.Redis = Depends(get_redis),
+        config: dict = Depends(get_conf)
+):
+    """
+    full text search over post titles and bodies, best matches first\n
+    `q` supports "quoted phrases", `or` and -excluded words\n
+    `snippet` is an HTML fragment of the body, escaped, with matches wrapped in <b></b>\n
+    relevance is approximate: only the `posts:search_candidates` newest matches are ranked\n
+    pass `next_cursor` of the previous page as `cursor` to fetch the next one\n
+
+    """
+    limit = max(min(20, limit), 1)
+
+    try:
+        items = await posts.search_posts(
+            conn,
+            q,
+            limit,
+            after=cursor,
+            candidates=config.get('posts', {}).get('search_candidates', posts.SEARCH_CANDIDATES)
+        )
+    except InvalidCursor:
+        return await error_400('Invalid cursor')
+
+    return encoding.model_response(posts_models.PostsSearchSuccessResponse(
+        data=posts_models.PostsSearchData(
+            items=await add_posts_likes_to_models(cache, primary_conn, items, session.session_user_id),
+            limit=limit,
+            next_cursor=posts.encode_search_cursor(items[-1]) if len(items) == limit else None
+        )
+    ))
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_posts(
+        request: Request,
+        author_id: Optional[int] = None,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+        conn: Connection = Depends(get_read_conn),
+        config: dict = Depends(get_conf)
+):
+    """
+    every post matching the filters as NDJSON (one post object per line), oldest first\n
+    `created_from` is inclusive, `created_to` exclusive\n
+    the posts are read with a server side cursor while the client reads,
+    a slow client slows the cursor down instead of filling memory\n
+    each export holds a db connection: at most `posts:export_concurrency` run at once,
+    others get 503, and one runs for at most `posts:export_timeout` seconds\n
+    an export that fails or times out once started ends with an error object line\n
+
+    """
+    slots: asyncio.Semaphore = request.app.state.export_slots
+    if slots.locked():
+        return await error_503()
+    return StreamingResponse(
+        ndjson(
+            posts.export_posts(conn, author_id, created_from, created_to),
+            slots,
+            config.get('posts', {}).get('export_timeout', EXPORT_TIMEOUT)
+        ),
+        media_type='application/x-ndjson'
     )
 
 
+@router.get("/{post_id}", response_model=posts_models.PostSuccessResponse)
+async def get_post(
+        post_id: int,
+        conn: Connection = Depends(get_conn),
+        session: Session = Depends(get_session),
+        cache: redis.Redis = Depends(get_redis),
+        post_cache: ModelCache = Depends(get_post_cache)
+):
+    """
+    post by id\n
+    if post not found return 404\n
+
+    """
+    if not (post := await get_cached_post(post_id, conn, cache, post_cache)):
+        return await error_404()
+    await add_posts_likes_to_models(cache, conn, [post], session.session_user_id)
+    return encoding.model_response(posts_models.PostSuccessResponse(
+        data=post
+    ))
+
+
 @router.post("/{post_id}", response_model=posts_models.PostSuccessResponse)
 async def update_post(
         post_id: int,
         update_model: posts_models.UpdatePost,
         conn: Connection = Depends(get_conn),
-        session: Session = Depends(get_session)
+        session: Session = Depends(get_session),
+        cache: redis.Redis = Depends(get_redis),
+        post_cache: ModelCache = Depends(get_post_cache)
 ):
     """
     update post\n
@@ -112,16 +296,23 @@ async def update_post(
     else return updated post\n
 
     """
-    if not (post := await posts.get_post(conn, post_id)):
-        return await error_404()
-    if post.author_id != session.session_user_id:
-        return await error_403()
     if update_model.body is None and update_model.title is None:
+        if not (post := await get_cached_post(post_id, conn, cache, post_cache)):
+            return await error_404()
+        if post.author_id != session.session_user_id:
+            return await error_403()
         return posts_models.PostSuccessResponse(
             data=post
         )
+    try:
+        if not (post := await posts.update_post(conn, post_id, session.session_user_id, update_model)):
+            return await error_404()
+    except NotOwnerError:
+        return await error_403()
+    await post_cache.invalidate(post_id, cache)
+    await timelines.invalidate(session.session_user_id, cache)
     return posts_models.PostSuccessResponse(
-        data=await posts.update_post(conn, post_id, update_model)
+        data=post
     )
 
 
@@ -129,25 +320,29 @@ async def update_post(
 async def delete_post(
         post_id: int,
         conn: Connection = Depends(get_conn),
-        session: Session = Depends(get_session)
+        session: Session = Depends(get_session),
+        cache: redis.Redis = Depends(get_redis),
+        post_cache: ModelCache = Depends(get_post_cache)
 ):
     """
     Post delete.\n
     if post not found return 404\n
     if post.author not equal current user return 403\n
-    if delete returns None, endpoint returns 500\n
 
     """
 
-    if not (post := await posts.get_post(conn, post_id)):
-        return await error_404()
-    if post.author_id != session.session_user_id:
+    try:
+        if not await posts.delete_post(
+                conn=conn,
+                post_id=post_id,
+                user_id=session.session_user_id
+        ):
+            return await error_404()
+    except NotOwnerError:
         return await error_403()
-    if not await posts.delete_post(
-            conn=conn,
-            post_id=post_id
-    ):
-        return error_500()
+    await post_cache.invalidate(post_id, cache)
+    await likes.remove(post_id, cache)
+    await timelines.invalidate(session.session_user_id, cache)
     return SuccessResponse()
 
 
@@ -156,43 +351,116 @@ async def like_post(
         post_id: int,
         conn: Connection = Depends(get_conn),
         session: Session = Depends(get_session),
-        cache: redis.Redis = Depends(get_redis)
+        cache: redis.Redis = Depends(get_redis),
+        post_cache: ModelCache = Depends(get_post_cache)
 ):
-    if not (post := await posts.get_post(
-            conn=conn,
-            post_id=post_id
-    )):
+    if not (post := await get_cached_post(post_id, conn, cache, post_cache)):
         return await error_404()
 
-    posts_likes = (await redis.get(
-        f"post_{post_id}",
-        conn=cache
-    )).get("likes", [])
-    if session.session_user_id in posts_likes:
-        posts_likes.remove(session.session_user_id)
-    else:
-        posts_likes.append(session.session_user_id)
-    await redis.set(
-        f"post_{post_id}",
-        value={
-            'likes': posts_likes
-        },
-        conn=cache
-    )
-    post.likes = posts_likes
+    post.liked_by_me, post.likes_count = await likes.toggle(post_id, session.session_user_id, cache, conn)
     return posts_models.PostSuccessResponse(
         data=post
     )
 
 
-async def add_post_likes_to_model(
-        cache: redis.Redis,
-        model: posts_models.Post
-) -> posts_models.Post:
-    model.likes = (
-        await redis.get(
-            key=f"post_{model.id}",
-            conn=cache
+@router.get("/{post_id}/likers", response_model=posts_models.LikersListSuccessResponse)
+async def get_post_likers(
+        post_id: int,
+        page: int = 1,
+        limit: int = 100,
+        conn: Connection = Depends(get_conn),
+        cache: redis.Redis = Depends(get_redis),
+        post_cache: ModelCache = Depends(get_post_cache)
+):
+    """
+    ids of users who liked the post, newest first, with pagination\n
+    if post not found return 404\n
+
+    """
+    limit = max(min(1000, limit), 1)
+    page = max(page, 1)
+
+    if not await get_cached_post(post_id, conn, cache, post_cache):
+        return await error_404()
+    likers, total = await likes.get_likers(
+        post_id,
+        cache,
+        conn,
+        offset=limit * (page - 1),
+        limit=limit
+    )
+    return posts_models.LikersListSuccessResponse(
+        data=posts_models.LikersListData(
+            items=likers,
+            limit=limit,
+            page=page,
+            total=total
         )
-    ).get('likes', [])
-    return model
+    )
+
+
+async def ndjson(
+        records: AsyncGenerator,
+        slots: asyncio.Semaphore,
+        timeout: Optional[float] = None
+) -> AsyncGenerator[bytes, None]:
+    """
+    Records as NDJSON chunks, read while holding one of `slots`. The status
+    is sent by then: a failure or the `timeout` passing is reported by a last
+    error line. `records` is closed however the stream ends.
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    lines = []
+    # taken here, not in the route: a body that never starts would keep it
+    async with slots:
+        try:
+            async for record in records:
+                lines.append(encoding.dumps(dict(record)))
+                if len(lines) == EXPORT_CHUNK_ROWS:
+                    yield b'\n'.join(lines) + b'\n'
+                    lines = []
+                    if deadline is not None and time.monotonic() > deadline:
+                        logger.warning(f'Export stopped after {timeout}s')
+                        yield encoding.dumps(ErrorResponse(error='export timed out').dict()) + b'\n'
+                        return
+            if lines:
+                yield b'\n'.join(lines) + b'\n'
+        except Exception:
+            logger.exception('Export failed')
+            lines.append(encoding.dumps(ErrorResponse(error='export failed').dict()))
+            yield b'\n'.join(lines) + b'\n'
+        finally:
+            await records.aclose()
+
+
+async def add_posts_likes_to_models(
+        cache: redis.Redis,
+        conn: Connection,
+        models: list[posts_models.Post],
+        user_id: Optional[int]
+) -> list[posts_models.Post]:
+    """
+    fills likes count and liked_by_me of every post with one redis round trip,
+    use it for any list. Posts missing in redis are loaded from `conn`, which
+    must not be a replica: a lagging one would cache stale likes
+    """
+    for model, (likes_count, liked_by_me) in zip(
+            models,
+            await likes.get_stats_many([i.id for i in models], user_id, cache, conn)
+    ):
+        model.likes_count = likes_count
+        model.liked_by_me = liked_by_me
+    return models
+
+
+async def get_cached_post(
+        post_id: int,
+        conn: Connection,
+        cache: redis.Redis,
+        post_cache: ModelCache
+) -> Optional[posts_models.Post]:
+    return await post_cache.get(
+        post_id,
+        cache,
+        lambda: posts.get_post(conn, post_id)
+    )
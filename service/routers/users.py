@@ -0,0 +1,69 @@
+import logging
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Request
+
+from db import posts
+from misc import redis, timelines, users, encoding
+from misc.cursor import InvalidCursor
+from misc.db import Connection
+from misc.depends.conf import get as get_conf
+from misc.depends.db import get as get_conn, get_read as get_read_conn
+from misc.depends.redis import get as get_redis
+from misc.depends.session import get as get_session
+from misc.handlers import error_400, error_404
+from misc.session import Session
+from models import posts as posts_models
+from service.routers.posts import check_auth, add_posts_likes_to_models
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(
+    prefix="/users",
+    tags=["Users"],
+    dependencies=[Depends(check_auth)]
+)
+
+
+@router.get("/{user_id}/posts", response_model=posts_models.AuthorPostsSuccessResponse)
+async def get_user_posts(
+        request: Request,
+        user_id: int,
+        limit: int = timelines.FIRST_PAGE_SIZE,
+        cursor: Optional[str] = None,
+        conn: Connection = Depends(get_read_conn),
+        primary_conn: Connection = Depends(get_conn),
+        session: Session = Depends(get_session),
+        cache: redis.Redis = Depends(get_redis),
+        config: dict = Depends(get_conf)
+):
+    """
+    posts of the user, newest first\n
+    pass `next_cursor` of the previous page as `cursor` to fetch the next one\n
+    if user not found return 404\n
+
+    """
+    limit = max(min(timelines.FIRST_PAGE_SIZE, limit), 1)
+
+    if await users.get_user(user_id, request.app.state.user_cache, primary_conn) is None:
+        return await error_404()
+    try:
+        items = await timelines.get_page(
+            user_id,
+            limit,
+            cursor,
+            cache,
+            conn,
+            primary_conn,
+            config.get('cache', {}).get('author_posts', {}).get('ttl', timelines.TTL)
+        )
+    except InvalidCursor:
+        return await error_400('Invalid cursor')
+
+    return encoding.model_response(posts_models.AuthorPostsSuccessResponse(
+        data=posts_models.AuthorPostsData(
+            items=await add_posts_likes_to_models(cache, primary_conn, items, session.session_user_id),
+            limit=limit,
+            next_cursor=posts.encode_cursor(items[-1]) if len(items) == limit else None
+        )
+    ))
@@ -3,10 +3,25 @@ import asyncio
 import asyncpg
 from redis.asyncio.client import Redis
 
+from misc.cache import ModelCache, LocalCache
+from misc.password import HashPool
+from misc.replicas import ReplicaSet
+from misc.tokens import RevocationList
+
 
 class State:
     def __init__(self, loop: asyncio.AbstractEventLoop, config: dict):
         self.loop = loop
         self.config = config
         self.db_pool: asyncpg.Pool = None
-        self.redis: Redis = None
\ No newline at end of file
+        self.db_replicas: ReplicaSet = None
+        self.replicas_checker: asyncio.Task = None
+        self.redis: Redis = None
+        self.likes_flusher: asyncio.Task = None
+        self.post_cache: ModelCache = None
+        self.user_cache: LocalCache = None
+        self.users_listener: asyncio.Task = None
+        self.revocations: RevocationList = None
+        self.revocations_refresher: asyncio.Task = None
+        self.password_pool: HashPool = None
+        self.export_slots: asyncio.Semaphore = None
\ No newline at end of file
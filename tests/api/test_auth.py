@@ -1,4 +1,18 @@
+import asyncio
+import time
+
 import pytest
+from async_asgi_testclient import TestClient
+
+from misc import password, tokens
+
+
+@pytest.fixture
+def signed_tokens(app):
+    session_config = app.state.config.setdefault('session', {})
+    session_config['signed_tokens'] = {'secret': 'test_secret'}
+    yield
+    del session_config['signed_tokens']
 
 
 @pytest.mark.asyncio
@@ -15,3 +29,110 @@ async def test_logout(client, resetdb, user):
 
     assert response.status_code == 200
     assert response.json()['data']['me']['id'] != user['user']['id']
+
+
+@pytest.mark.asyncio
+async def test_sign_up_name_taken(client, resetdb, user):
+    await client.post('/api/v1/auth/logout')
+    response = await client.post(
+        "/api/v1/auth/sign-up",
+        json={
+            'name': user['user']['name'],
+            "password": "password"
+        }
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_anonymous_session_not_stored(app):
+    response = await TestClient(app).get("/api/v1/auth/me")
+
+    assert response.status_code == 200
+    assert not await app.state.redis.exists(f"session_{response.json()['data']['token']}")
+
+
+@pytest.mark.asyncio
+async def test_sign_in(app, user):
+    client = TestClient(app)
+    response = await client.post(
+        "/api/v1/auth/sign-in",
+        json={
+            'name': user['user']['name'],
+            "password": "password"
+        }
+    )
+
+    assert response.status_code == 200
+    assert response.json()['data']['me']['id'] == user['user']['id']
+
+
+@pytest.mark.asyncio
+async def test_sign_in_wrong_password(app, user):
+    response = await TestClient(app).post(
+        "/api/v1/auth/sign-in",
+        json={
+            'name': user['user']['name'],
+            "password": "wrong_password"
+        }
+    )
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_signed_token_logout(app, resetdb, user, signed_tokens):
+    user_id = user['user']['id']
+    credentials = {'name': user['user']['name'], 'password': 'password'}
+    response = await TestClient(app).post('/api/v1/auth/sign-in', json=credentials)
+    token = response.json()['data']['token']
+    assert tokens.is_signed(token)
+
+    response = await TestClient(app).get('/api/v1/auth/me', headers={'X-SID': token})
+    assert response.json()['data']['me']['id'] == user_id
+
+    await TestClient(app).post('/api/v1/auth/logout', headers={'X-SID': token})
+    response = await TestClient(app).get('/api/v1/auth/me', headers={'X-SID': token})
+    assert response.json()['data']['me']['id'] == 0
+
+    # a worker that has not seen the logout yet signs with the current epoch
+    app.state.revocations._epochs.pop(user_id)
+    response = await TestClient(app).post('/api/v1/auth/sign-in', json=credentials)
+    token = response.json()['data']['token']
+    await app.state.revocations.refresh(app.state.redis)
+    response = await TestClient(app).get('/api/v1/auth/me', headers={'X-SID': token})
+    assert response.json()['data']['me']['id'] == user_id
+
+
+@pytest.mark.asyncio
+async def test_sign_in_pool_busy(app, user):
+    busy_pool = password.HashPool(workers=1, queue_size=0)
+    running = asyncio.ensure_future(busy_pool.run(time.sleep, 0.5))
+    await asyncio.sleep(0)
+    pool, app.state.password_pool = app.state.password_pool, busy_pool
+    try:
+        response = await TestClient(app).post(
+            "/api/v1/auth/sign-in",
+            json={'name': user['user']['name'], "password": "password"}
+        )
+    finally:
+        app.state.password_pool = pool
+        await running
+        busy_pool.close()
+
+    assert response.status_code == 503
+    assert response.headers['retry-after'] == '1'
+
+
+@pytest.mark.asyncio
+async def test_sign_in_unknown_user_hashes(app, resetdb):
+    hashes = sum(sum(value[:-1]) for _, value in password.HASH_SECONDS.snapshot())
+    response = await TestClient(app).post(
+        "/api/v1/auth/sign-in",
+        json={'name': 'unknown_user_name', "password": "password"}
+    )
+
+    assert response.status_code == 404
+    # same bcrypt round as a wrong password, the name can't be probed by timing
+    assert sum(sum(value[:-1]) for _, value in password.HASH_SECONDS.snapshot()) == hashes + 1
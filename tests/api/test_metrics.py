@@ -0,0 +1,23 @@
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_metrics(client, user):
+    await client.get("/api/v1/posts/")
+    response = await client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'http_request_seconds_bucket{method="GET",route="/api/v1/posts/",status="200",le="0.005"}' in response.text
+    assert 'db_pool_connections{pool="primary",state="idle"}' in response.text
+    assert 'cache_hits_total{cache="users",tier="local"}' in response.text
+
+
+@pytest.mark.asyncio
+async def test_metrics_statement_cache(client, user):
+    for _ in range(3):
+        await client.get("/api/v1/posts/")
+    response = await client.get("/metrics")
+
+    assert 'db_statement_cache_total{result="hit"}' in response.text
+    assert 'cache_hits_total{cache="query_text",tier="local"}' in response.text
@@ -1,5 +1,25 @@
+import asyncio
+import json
+
 import pytest
 from async_asgi_testclient import TestClient
+from redis.exceptions import LockNotOwnedError
+
+from db import posts as posts_db
+from misc import counters, db, likes, replicas
+from misc.cache import ModelCache
+from models.posts import Post
+from service.routers import posts as posts_router
+
+
+@pytest.fixture
+async def replica(app):
+    pool = await db.init(app.state.config['db'])
+    instance = replicas.Replica('test_replica', pool)
+    app.state.db_replicas.replicas.append(instance)
+    yield instance
+    app.state.db_replicas.replicas.remove(instance)
+    await db.close(pool)
 
 
 @pytest.mark.asyncio
@@ -7,6 +27,141 @@ async def test_create_post(client, resetdb, user, post):
     ...
 
 
+@pytest.mark.asyncio
+async def test_create_posts_batch(client: TestClient, resetdb, user):
+    response = await client.post(
+        "/api/v1/posts/batch",
+        json={'items': [
+            {'title': 'batch_title1', 'body': 'batch_body1'},
+            {'title': 'x' * 256, 'body': 'batch_body2'},
+            {'title': 'batch_title3', 'body': 'batch_body3'},
+            'not an object',
+            {'title': 'batch_title5', 'body': 'nul\u0000body'}
+        ]}
+    )
+
+    assert response.status_code == 200
+    data = response.json()['data']
+    assert (data['created'], data['failed']) == (2, 3)
+    assert [i['index'] for i in data['items']] == [0, 1, 2, 3, 4]
+    assert all(data['items'][i]['id'] is None and data['items'][i]['error'] for i in (1, 3, 4))
+
+    response = await client.get(f"/api/v1/posts/{data['items'][2]['id']}")
+    assert response.status_code == 200
+    assert response.json()['data']['title'] == 'batch_title3'
+    assert response.json()['data']['likes_count'] == 0
+
+
+@pytest.mark.asyncio
+async def test_get_posts_filtered(client: TestClient, resetdb, user, post):
+    response = await client.get(f"/api/v1/posts/?filter=id:in:{post['id']},{2 ** 62}&order=created_at,id")
+
+    assert response.status_code == 200
+    assert [i['id'] for i in response.json()['data']['items']] == [post['id']]
+    assert response.json()['data']['total_mode'] == 'none'
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        'filter=body:eq:test_body',
+        'filter=id:like:1',
+        'filter=id:eq:abc',
+        'filter=id:eq:99999999999999999999999',
+        'order=title',
+    ])
+@pytest.mark.asyncio
+async def test_get_posts_invalid_lookup(client: TestClient, resetdb, user, query):
+    response = await client.get(f"/api/v1/posts/?{query}")
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_search_posts(client: TestClient, resetdb, user):
+    response = await client.post(
+        "/api/v1/posts/",
+        json={'title': 'walrus migration', 'body': 'walruses were seen migrating north'}
+    )
+    assert response.status_code == 200
+    post_id = response.json()['data']['id']
+
+    response = await client.get('/api/v1/posts/search?q=walrus')
+
+    assert response.status_code == 200
+    items = response.json()['data']['items']
+    assert [i['id'] for i in items] == [post_id]
+    assert '<b>' in items[0]['snippet']
+
+    response = await client.get('/api/v1/posts/search?q=garbage&cursor=garbage')
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_search_posts_snippet_escaped(client: TestClient, resetdb, user):
+    await client.post(
+        "/api/v1/posts/",
+        json={'title': 'narwhal', 'body': 'narwhal <script>alert(1)</script> & friends'}
+    )
+
+    response = await client.get('/api/v1/posts/search?q=narwhal')
+
+    snippet = response.json()['data']['items'][0]['snippet']
+    assert '<script>' not in snippet
+    assert '&lt;script&gt;' in snippet and '&amp;' in snippet
+    assert '<b>narwhal</b>' in snippet
+
+
+@pytest.mark.asyncio
+async def test_export_posts(client: TestClient, resetdb, user, post):
+    response = await client.get(f"/api/v1/posts/export?author_id={user['user']['id']}")
+
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/x-ndjson'
+    exported = [json.loads(i) for i in response.text.splitlines()]
+    assert post['id'] in [i['id'] for i in exported]
+    assert {i['author_id'] for i in exported} == {user['user']['id']}
+
+    response = await client.get(f"/api/v1/posts/export?author_id={2 ** 62}")
+    assert response.status_code == 200
+    assert response.text == ''
+
+
+@pytest.mark.asyncio
+async def test_export_posts_busy(app, client: TestClient, resetdb, user):
+    slots = app.state.export_slots
+    taken = 0
+    while not slots.locked():
+        await slots.acquire()
+        taken += 1
+    try:
+        response = await client.get("/api/v1/posts/export")
+        assert response.status_code == 503
+    finally:
+        for _ in range(taken):
+            slots.release()
+
+
+@pytest.mark.asyncio
+async def test_export_posts_failure_line():
+    closed = []
+
+    async def records():
+        try:
+            yield {'id': 1}
+            raise RuntimeError('connection lost')
+        finally:
+            closed.append(True)
+
+    slots = asyncio.Semaphore(1)
+    chunks = [i async for i in posts_router.ndjson(records(), slots)]
+
+    lines = [json.loads(i) for i in b''.join(chunks).splitlines()]
+    assert lines[0] == {'id': 1}
+    assert lines[-1]['error'] == 'export failed'
+    assert closed and not slots.locked()
+
+
 @pytest.mark.parametrize(
     "title,body",
     [
@@ -30,6 +185,62 @@ async def test_update_post(client: TestClient, resetdb, user, post, title, body)
     assert response.status_code == 200
 
 
+@pytest.mark.asyncio
+async def test_update_post_not_found(client: TestClient, resetdb, user):
+    response = await client.post(
+        f"/api/v1/posts/{2 ** 62}",
+        json={'title': 'new_title'}
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_delete_post_not_found(client: TestClient, resetdb, user):
+    response = await client.delete(f"/api/v1/posts/{2 ** 62}")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_change_post_not_owner(app, client: TestClient, resetdb, user, post):
+    other = TestClient(app)
+    response = await other.post(
+        "/api/v1/auth/sign-up",
+        json={'name': f"other_{post['id']}", "password": "password"}
+    )
+    assert response.status_code == 200
+
+    response = await other.post(f"/api/v1/posts/{post['id']}", json={'title': 'stolen_title'})
+    assert response.status_code == 403
+    response = await other.delete(f"/api/v1/posts/{post['id']}")
+    assert response.status_code == 403
+
+    response = await client.get(f"/api/v1/posts/{post['id']}")
+    assert response.status_code == 200
+    assert response.json()['data']['title'] == post['title']
+
+
+@pytest.mark.asyncio
+async def test_get_post(client: TestClient, resetdb, user, post):
+    response = await client.get(f"/api/v1/posts/{post['id']}")
+
+    assert response.status_code == 200
+    assert response.json()['data']['title'] == post['title']
+
+
+@pytest.mark.asyncio
+async def test_get_post_after_update(client: TestClient, resetdb, user, post):
+    await client.get(f"/api/v1/posts/{post['id']}")
+    await client.post(
+        f"/api/v1/posts/{post['id']}",
+        json={'title': 'updated_title'}
+    )
+    response = await client.get(f"/api/v1/posts/{post['id']}")
+
+    assert response.status_code == 200
+    assert response.json()['data']['title'] == 'updated_title'
+
+
 @pytest.mark.asyncio
 async def test_delete_post(client: TestClient, resetdb, user, post):
     response = await client.delete(f"/api/v1/posts/{post['id']}")
@@ -53,6 +264,7 @@ async def test_get_list_posts(
     assert response.status_code == 200
     assert response.json()['data']['limit'] == limit
     assert response.json()['data']['page'] == page
+    assert response.json()['data']['total_mode'] in ('count', 'exact', 'estimate', 'cached')
 
 
 @pytest.mark.asyncio
@@ -66,10 +278,189 @@ async def test_post_like(
         f"/api/v1/posts/{post['id']}/like"
     )
     assert response1.status_code == 200
-    assert user['user']['id'] in response1.json()['data']['likes']
+    assert response1.json()['data']['liked_by_me'] is True
+    assert response1.json()['data']['likes_count'] == 1
 
     response2 = await client.get(
         f"/api/v1/posts/{post['id']}/like"
     )
     assert response2.status_code == 200
-    assert user['user']['id'] not in response2.json()['data']['likes']
+    assert response2.json()['data']['liked_by_me'] is False
+    assert response2.json()['data']['likes_count'] == 0
+
+
+@pytest.mark.asyncio
+async def test_post_likers(
+        client: TestClient,
+        resetdb,
+        user,
+        post
+):
+    await client.get(f"/api/v1/posts/{post['id']}/like")
+
+    response = await client.get(f"/api/v1/posts/{post['id']}/likers")
+    assert response.status_code == 200
+    assert response.json()['data']['items'] == [user['user']['id']]
+    assert response.json()['data']['total'] == 1
+
+
+@pytest.mark.asyncio
+async def test_get_list_posts_cursor(
+        client: TestClient,
+        resetdb,
+        user,
+        post
+):
+    await client.post(
+        "/api/v1/posts/",
+        json={
+            "title": "test_title",
+            "body": "test_body"
+        }
+    )
+    response1 = await client.get('/api/v1/posts/?limit=1')
+    assert response1.status_code == 200
+    next_cursor = response1.json()['data']['next_cursor']
+    assert next_cursor
+
+    response2 = await client.get(f'/api/v1/posts/?limit=1&cursor={next_cursor}')
+    assert response2.status_code == 200
+    assert response2.json()['data']['items'][0]['id'] < response1.json()['data']['items'][0]['id']
+
+
+@pytest.mark.asyncio
+async def test_get_list_posts_invalid_cursor(
+        client: TestClient,
+        resetdb,
+        user
+):
+    response = await client.get('/api/v1/posts/?cursor=garbage')
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_post_like_flushed(
+        app,
+        client: TestClient,
+        db_pool,
+        resetdb,
+        user,
+        post
+):
+    response = await client.get(f"/api/v1/posts/{post['id']}/like")
+    assert response.status_code == 200
+
+    await likes.flush(db_pool, app.state.redis)
+    assert await db_pool.fetchval(
+        'SELECT count(*) FROM post_likes WHERE post_id = $1 AND user_id = $2',
+        post['id'],
+        user['user']['id']
+    ) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_list_posts_total_exact(client: TestClient, db_pool, resetdb, user):
+    response = await client.get('/api/v1/posts/')
+    assert response.json()['data']['total_mode'] == counters.EXACT
+    total = response.json()['data']['total']
+    assert total == await db_pool.fetchval('SELECT count(*) FROM posts')
+
+    response = await client.post("/api/v1/posts/", json={"title": "test_title", "body": "test_body"})
+    post_id = response.json()['data']['id']
+    response = await client.get('/api/v1/posts/')
+    assert response.json()['data']['total'] == total + 1
+
+    await client.delete(f"/api/v1/posts/{post_id}")
+    response = await client.get('/api/v1/posts/')
+    assert response.json()['data']['total'] == total
+
+
+@pytest.mark.asyncio
+async def test_get_total_cached(app, db_pool, resetdb, user, post):
+    config = {'posts': {'mode': counters.CACHED, 'ttl': 60}}
+    await app.state.redis.delete(counters.cache_key('posts'))
+    total = await db_pool.fetchval('SELECT count(*) FROM posts')
+    assert await counters.get_total('posts', db_pool, app.state.redis, config) == (total, counters.CACHED)
+
+    await db_pool.execute('DELETE FROM posts WHERE id = $1', post['id'])
+    # served from redis until the ttl passes
+    assert await counters.get_total('posts', db_pool, app.state.redis, config) == (total, counters.CACHED)
+
+    await app.state.redis.delete(counters.cache_key('posts'))
+    assert await counters.get_total('posts', db_pool, app.state.redis, config) == (total - 1, counters.CACHED)
+
+
+@pytest.mark.parametrize('write', [
+    "UPDATE posts SET title = 'concurrent_title' WHERE id = $1",
+    'DELETE FROM posts WHERE id = $1',
+])
+@pytest.mark.asyncio
+async def test_post_not_pinned_by_concurrent_write(app, db_pool, resetdb, user, post, write):
+    post_cache = ModelCache('test_post', Post, local_size=0)
+    await post_cache.invalidate(post['id'], app.state.redis)
+
+    async def load():
+        # the post changes after it's read, before it's cached
+        model = await posts_db.get_post(db_pool, post['id'])
+        await db_pool.execute(write, post['id'])
+        await post_cache.invalidate(post['id'], app.state.redis)
+        return model
+
+    stale = await post_cache.get(post['id'], app.state.redis, load)
+    assert stale.title == post['title']
+
+    fresh = await post_cache.get(post['id'], app.state.redis, lambda: posts_db.get_post(db_pool, post['id']))
+    assert fresh is None or fresh.title == 'concurrent_title'
+    assert (fresh is None) == write.startswith('DELETE')
+
+
+@pytest.mark.asyncio
+async def test_read_after_write_from_primary(app, resetdb, replica):
+    replica_set = app.state.db_replicas
+    sticky_window = replica_set.sticky_window
+    client = TestClient(app)
+    replica_set.sticky_window = 0
+    try:
+        response = await client.post("/api/v1/auth/sign-up", json={'name': 'replica_reader', 'password': 'password'})
+        assert response.status_code == 200
+    finally:
+        replica_set.sticky_window = sticky_window
+
+    replica_reads = replica_set.replica_reads
+    await client.get('/api/v1/posts/')
+    assert replica_set.replica_reads > replica_reads
+
+    response = await client.post("/api/v1/posts/", json={"title": "test_title", "body": "test_body"})
+    post_id = response.json()['data']['id']
+    replica_reads, primary_reads = replica_set.replica_reads, replica_set.primary_reads
+    response = await client.get('/api/v1/posts/')
+    assert response.json()['data']['items'][0]['id'] == post_id
+    assert replica_set.replica_reads == replica_reads
+    assert replica_set.primary_reads > primary_reads
+
+
+@pytest.mark.asyncio
+async def test_post_like_flush_lock_lost(
+        app,
+        client: TestClient,
+        db_pool,
+        resetdb,
+        user,
+        post
+):
+    conn = app.state.redis
+    lock = conn.lock(likes.FLUSH_LOCK_KEY, timeout=30)
+    assert await lock.acquire(blocking=False)
+    await client.get(f"/api/v1/posts/{post['id']}/like")
+    # the lock expired and another worker took it
+    await conn.set(likes.FLUSH_LOCK_KEY, 'other_worker')
+
+    with pytest.raises(LockNotOwnedError):
+        await likes.flush(db_pool, conn, lock)
+    assert await db_pool.fetchval('SELECT count(*) FROM post_likes WHERE post_id = $1', post['id']) == 0
+    assert await conn.llen(likes.BATCHES_KEY) == 1
+
+    await conn.delete(likes.FLUSH_LOCK_KEY)
+    await likes.flush(db_pool, conn)
+    assert await db_pool.fetchval('SELECT count(*) FROM post_likes WHERE post_id = $1', post['id']) == 1
+    assert await conn.llen(likes.BATCHES_KEY) == 0
@@ -0,0 +1,160 @@
+import asyncio
+
+import pytest
+from async_asgi_testclient import TestClient
+
+from misc import db, timelines, users
+from misc.cache import MISSING
+
+
+@pytest.mark.asyncio
+async def test_get_user_posts(client: TestClient, resetdb, user, post):
+    response = await client.get(f"/api/v1/users/{post['author_id']}/posts")
+
+    assert response.status_code == 200
+    data = response.json()['data']
+    assert [i['id'] for i in data['items']] == [post['id']]
+    assert data['next_cursor'] is None
+
+
+@pytest.mark.asyncio
+async def test_get_user_posts_invalidated(client: TestClient, resetdb, user, post):
+    response = await client.get(f"/api/v1/users/{post['author_id']}/posts")
+    assert len(response.json()['data']['items']) == 1
+
+    response = await client.post("/api/v1/posts/", json={'title': 'title2', 'body': 'body2'})
+    new_id = response.json()['data']['id']
+
+    response = await client.get(f"/api/v1/users/{post['author_id']}/posts")
+    assert [i['id'] for i in response.json()['data']['items']] == [new_id, post['id']]
+
+    await client.delete(f"/api/v1/posts/{new_id}")
+    response = await client.get(f"/api/v1/users/{post['author_id']}/posts")
+    assert [i['id'] for i in response.json()['data']['items']] == [post['id']]
+
+
+@pytest.mark.asyncio
+async def test_get_user_posts_paginated(client: TestClient, resetdb, user, post):
+    await client.post("/api/v1/posts/", json={'title': 'title2', 'body': 'body2'})
+
+    response = await client.get(f"/api/v1/users/{post['author_id']}/posts?limit=1")
+    assert response.status_code == 200
+    cursor = response.json()['data']['next_cursor']
+    response = await client.get(f"/api/v1/users/{post['author_id']}/posts?limit=1&cursor={cursor}")
+    assert [i['id'] for i in response.json()['data']['items']] == [post['id']]
+
+
+@pytest.mark.asyncio
+async def test_get_user_posts_not_found(client: TestClient, resetdb, user):
+    response = await client.get(f"/api/v1/users/{2 ** 62}/posts")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_user_snapshot_cached(app, db_pool, resetdb, user):
+    user_id, name = user['user']['id'], user['user']['name']
+    cache = app.state.user_cache
+    cache.delete(user_id)
+    assert (await users.get_user(user_id, cache, db_pool)).name == name
+
+    await db_pool.execute('UPDATE users SET name = $2 WHERE id = $1', user_id, f'{name}_direct')
+    # served from the snapshot until it is invalidated
+    assert (await users.get_user(user_id, cache, db_pool)).name == name
+
+    await users.invalidate(user_id, cache, app.state.redis)
+    assert (await users.get_user(user_id, cache, db_pool)).name == f'{name}_direct'
+
+    await users.update(user_id, {'name': name}, cache, db_pool, app.state.redis)
+    assert (await users.get_user(user_id, cache, db_pool)).name == name
+
+
+def user_lookups() -> int:
+    return sum(
+        sum(value[:-1])
+        for (statement,), value in db.QUERY_SECONDS.snapshot()
+        if 'FROM users WHERE id' in statement
+    )
+
+
+@pytest.mark.asyncio
+async def test_user_snapshot_no_queries_on_hit(app, client: TestClient, resetdb, user):
+    app.state.user_cache.delete(user['user']['id'])
+    lookups = user_lookups()
+    response = await client.get("/api/v1/auth/me")
+    assert response.status_code == 200
+    assert response.json()['data']['me']['id'] == user['user']['id']
+    assert user_lookups() > lookups
+
+    lookups = user_lookups()
+    for _ in range(5):
+        response = await client.get("/api/v1/auth/me")
+        assert response.json()['data']['me']['id'] == user['user']['id']
+    assert user_lookups() == lookups
+
+
+@pytest.mark.asyncio
+async def test_user_snapshot_invalidated_by_other_worker(app, db_pool, resetdb, user):
+    user_id = user['user']['id']
+    await users.get_user(user_id, app.state.user_cache, db_pool)
+    assert app.state.user_cache.get(user_id) is not MISSING
+
+    await users.invalidate(user_id, users.init_cache({}), app.state.redis)
+    for _ in range(100):
+        if app.state.user_cache.get(user_id) is MISSING:
+            break
+        await asyncio.sleep(0.01)
+    assert app.state.user_cache.get(user_id) is MISSING
+
+
+@pytest.mark.asyncio
+async def test_disabled_user_signed_out(app, client: TestClient, db_pool, resetdb, user):
+    user_id = user['user']['id']
+    await client.get("/api/v1/auth/me")
+
+    await users.update(user_id, {'en': False}, app.state.user_cache, db_pool, app.state.redis)
+    response = await client.get("/api/v1/auth/me")
+    assert response.json()['data']['me']['id'] == 0
+
+    await users.update(user_id, {'en': True}, app.state.user_cache, db_pool, app.state.redis)
+    response = await client.get("/api/v1/auth/me")
+    assert response.json()['data']['me']['id'] == user_id
+
+
+class WriteAfterRead(object):
+    """
+    Connection that runs `write` right after a read, like a post created
+    while a timeline page is being loaded
+    """
+
+    def __init__(self, conn, write):
+        super().__init__()
+        self.conn = conn
+        self.write = write
+
+    async def fetch(self, *args, **kwargs):
+        rows = await self.conn.fetch(*args, **kwargs)
+        await self.write()
+        return rows
+
+
+@pytest.mark.asyncio
+async def test_first_page_not_pinned_by_concurrent_write(app, db_pool, resetdb, user, post):
+    author_id = post['author_id']
+    new_ids = []
+
+    async def write():
+        new_ids.append(await db_pool.fetchval(
+            'INSERT INTO posts (title, body, author_id) VALUES ($1, $2, $3) RETURNING id',
+            'concurrent_title',
+            'concurrent_body',
+            author_id
+        ))
+        await timelines.invalidate(author_id, app.state.redis)
+
+    await timelines.invalidate(author_id, app.state.redis)
+    stale = await timelines.get_first_page(author_id, app.state.redis, WriteAfterRead(db_pool, write))
+    assert new_ids[0] not in [i.id for i in stale]
+
+    page = await timelines.get_first_page(author_id, app.state.redis, db_pool)
+    assert page[0].id == new_ids[0]
@@ -0,0 +1,176 @@
+import contextlib
+import datetime
+import logging
+import time
+from typing import List, Optional
+
+import pytest
+from pydantic import BaseModel, Field, PrivateAttr
+
+from misc import db
+
+
+class Item(BaseModel):
+    id: int
+    title: str = 'untitled'
+    tags: List[str] = []
+    labels: List[str] = Field(default_factory=list)
+    created_at: Optional[datetime.datetime] = None
+    _seen: set = PrivateAttr(default_factory=set)
+
+
+class AliasedItem(BaseModel):
+    id: int
+    name: str = Field(alias='title')
+
+
+def test_trusted_converter_values():
+    now = datetime.datetime.now()
+    item = db.record_to_model(Item, {'id': 1, 'title': 'first', 'created_at': now, 'unknown': 1}, trusted=True)
+
+    assert item == Item(id=1, title='first', created_at=now)
+    assert item.__fields_set__ == {'id', 'title', 'created_at'}
+    assert not hasattr(item, 'unknown')
+
+
+def test_trusted_converter_defaults():
+    items = db.record_to_model_list(Item, [{'id': 1}, {'id': 2}], trusted=True)
+
+    assert items == [Item(id=1), Item(id=2)]
+    assert items[0].__fields_set__ == {'id'}
+    # mutable and factory defaults are not shared between rows
+    items[0].tags.append('a')
+    items[0].labels.append('a')
+    assert items[1].tags == [] and items[1].labels == []
+
+
+def test_trusted_converter_private_attributes():
+    first, second = db.record_to_model_list(Item, [{'id': 1}, {'id': 2}], trusted=True)
+
+    first._seen.add(1)
+    assert second._seen == set()
+
+
+def test_trusted_converter_alias():
+    assert db.record_to_model(AliasedItem, {'id': 1, 'title': 'first'}, trusted=True).name == 'first'
+
+
+def test_trusted_converter_missing_required():
+    with pytest.raises(ValueError, match='id'):
+        db.compile_converter(Item, ('title',))
+
+
+def test_trusted_converter_cached():
+    assert db.trusted_converter(Item, ('id',)) is db.trusted_converter(Item, ('id',))
+    assert db.trusted_converter(Item, ('id',)) is not db.trusted_converter(Item, ('id', 'title'))
+
+
+def test_record_to_model_empty():
+    assert db.record_to_model(Item, None, trusted=True) is None
+    assert db.record_to_model_list(Item, [], trusted=True) == []
+
+
+class FakeConnection(object):
+    def __init__(self, result, delay: float = 0):
+        super().__init__()
+        self.result = result
+        self.delay = delay
+        self.queries = []
+
+    async def fetch(self, query, *args, **kwargs):
+        self.queries.append((query, args))
+        if isinstance(self.result, Exception):
+            raise self.result
+        time.sleep(self.delay)
+        return self.result
+
+
+class FakePool(object):
+    def __init__(self, conn: FakeConnection):
+        super().__init__()
+        self.conn = conn
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        yield self.conn
+
+
+def test_normalize():
+    instrumentation = db.Instrumentation()
+
+    assert instrumentation.normalize("SELECT *\n  FROM posts WHERE id = 42 AND title = 'it''s'") == \
+        'SELECT * FROM posts WHERE id = ? AND title = ?'
+    assert instrumentation.normalize('SELECT * FROM posts WHERE id = $1') == 'SELECT * FROM posts WHERE id = $1'
+    assert len(instrumentation.normalize('SELECT ' + 'x, ' * 1000)) == db.STATEMENT_LENGTH
+
+
+def test_normalize_bounded(monkeypatch):
+    monkeypatch.setattr(db, 'MAX_STATEMENTS', 2)
+    instrumentation = db.Instrumentation()
+
+    assert instrumentation.normalize('SELECT a FROM t') == 'SELECT a FROM t'
+    assert instrumentation.normalize('SELECT b FROM t') == 'SELECT b FROM t'
+    assert instrumentation.normalize('SELECT c FROM t') == db.OTHER_STATEMENT
+    assert instrumentation.normalize('SELECT a FROM t') == 'SELECT a FROM t'
+
+
+@pytest.mark.parametrize(
+    "result,rows",
+    [
+        ([1, 2, 3], 3),
+        ('INSERT 0 5', 5),
+        ('UPDATE 3', 3),
+        ('CREATE INDEX', 0),
+        (None, 0),
+        (7, 1),
+    ])
+def test_row_count(result, rows):
+    assert db.row_count(result) == rows
+
+
+@pytest.mark.asyncio
+async def test_instrumentation_run():
+    instrumentation = db.Instrumentation(slow_threshold=None)
+    statement = 'SELECT id FROM instrumented WHERE id = $1'
+    conn = FakeConnection([1, 2])
+
+    assert await instrumentation.run(conn, 'fetch', statement, (1,), {}) == [1, 2]
+    assert conn.queries == [(statement, (1,))]
+    assert (statement,) in dict(db.QUERY_SECONDS.snapshot())
+    assert dict(db.QUERY_ROWS.snapshot())[(statement,)][-1] == 2
+
+    with pytest.raises(ValueError):
+        await instrumentation.run(FakeConnection(ValueError()), 'fetch', statement, (1,), {})
+    assert dict(db.QUERY_ERRORS.snapshot())[(statement,)] == 1
+
+
+@pytest.mark.asyncio
+async def test_instrumentation_slow_log(caplog):
+    instrumentation = db.Instrumentation(slow_threshold=0.01, explain=True)
+    conn = FakeConnection([('Seq Scan on slow',)], delay=0.02)
+
+    with caplog.at_level(logging.WARNING, logger='misc.db'):
+        await instrumentation.run(conn, 'fetch', 'SELECT * FROM slow WHERE id = $1', (1,), {})
+
+    assert instrumentation.slow_queries == 1
+    assert conn.queries[1] == ('EXPLAIN SELECT * FROM slow WHERE id = $1', (1,))
+    assert 'Slow query' in caplog.text and 'Seq Scan on slow' in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_lazy_connection_on_use():
+    conn = FakeConnection([1])
+    handle = db.LazyConnection(FakePool(conn))
+    used = []
+
+    async def on_use():
+        # runs before the statement is sent
+        used.append(len(conn.queries))
+
+    handle.on_use = on_use
+    await handle.fetch('SELECT 1')
+    async with handle.acquire():
+        await handle.fetch('SELECT 2')
+
+    assert used == [0]
+    assert len(conn.queries) == 2
@@ -0,0 +1,54 @@
+import datetime
+
+import pytest
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from misc import encoding, handlers
+from models.posts import Post, PostSuccessResponse
+
+
+@pytest.mark.asyncio
+async def test_configure_reaches_error_helpers():
+    try:
+        assert encoding.configure(False) is JSONResponse
+        assert type(await handlers.error_404()) is JSONResponse
+        assert encoding.configure(True) is ORJSONResponse
+        assert type(await handlers.error_404()) is ORJSONResponse
+    finally:
+        encoding.configure()
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_dumps_loads(monkeypatch, fast):
+    if not fast:
+        monkeypatch.setattr(encoding, 'orjson', None)
+    value = {'id': 1, 'created_at': datetime.datetime(2026, 1, 1), 2: 'non str key'}
+
+    assert encoding.loads(encoding.dumps(value)) == {'id': 1, 'created_at': '2026-01-01T00:00:00', '2': 'non str key'}
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("fast", [True, False])
+async def test_model_response_matches_response_model(fast):
+    response = PostSuccessResponse(data=Post(
+        id=1,
+        title='title',
+        body='body',
+        author_id=2,
+        created_at=datetime.datetime(2026, 1, 1, 12, 30, 15, 123456),
+        likes_count=3,
+        liked_by_me=True
+    ))
+    field = APIRoute('/', endpoint, response_model=PostSuccessResponse).secure_cloned_response_field
+    try:
+        encoding.configure(fast)
+        assert encoding.loads(encoding.model_response(response).body) == encoding.loads(
+            encoding.APIResponse(await serialize_response(field=field, response_content=response)).body
+        )
+    finally:
+        encoding.configure()
+
+
+async def endpoint():
+    ...
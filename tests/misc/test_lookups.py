@@ -0,0 +1,75 @@
+import pytest
+
+from misc import lookups
+from models.base import Filter, Lookup, OperatorType
+
+COLUMNS = {
+    'id': lookups.Column(lookups.int8, lookups.RANGE + (OperatorType.IN,)),
+    'title': lookups.Column(str, (OperatorType.EQ,)),
+}
+ORDERS = [['-created_at', '-id'], ['created_at', 'id']]
+
+
+def test_compile_lookup():
+    lookup = Lookup(
+        filters=[lookups.parse_filter('id:gte:10'), lookups.parse_filter('title:eq:a:b')],
+        order=lookups.parse_order('created_at,id')
+    )
+
+    assert lookups.compile_lookup(lookup, COLUMNS, ORDERS, first_idx=3) == (
+        'id >= $3 AND title = $4',
+        [10, 'a:b'],
+        ['created_at', 'id']
+    )
+
+
+def test_compile_lookup_empty():
+    assert lookups.compile_lookup(Lookup(), COLUMNS, ORDERS) == ('', [], None)
+
+
+def test_compile_in():
+    where, values = lookups.compile_filters([lookups.parse_filter('id:in:1,2,3')], COLUMNS)
+
+    assert where == 'id = ANY($1)'
+    assert values == [[1, 2, 3]]
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        'body:eq:x',
+        'title:like:x',
+        'id:eq:abc',
+        'id:eq:9223372036854775808',
+        'id:lt:-9223372036854775809',
+        'id:in:1,99999999999999999999999',
+    ])
+def test_compile_filters_invalid(text):
+    with pytest.raises(lookups.InvalidLookup):
+        lookups.compile_filters([lookups.parse_filter(text)], COLUMNS)
+
+
+def test_int8_bounds():
+    assert lookups.int8(str(lookups.INT8_MAX)) == lookups.INT8_MAX
+    assert lookups.int8(str(lookups.INT8_MIN)) == lookups.INT8_MIN
+    with pytest.raises(ValueError):
+        lookups.int8(str(lookups.INT8_MAX + 1))
+
+
+def test_compile_filters_limits():
+    with pytest.raises(lookups.InvalidLookup):
+        lookups.compile_filters([Filter(field='id', operator=OperatorType.EQ, value=1)] * 6, COLUMNS)
+    with pytest.raises(lookups.InvalidLookup):
+        lookups.compile_filters([lookups.parse_filter('id:in:' + ','.join(['1'] * 101))], COLUMNS)
+
+
+@pytest.mark.parametrize("text", ['id', 'id:eq', 'id:unknown:1'])
+def test_parse_filter_invalid(text):
+    with pytest.raises(lookups.InvalidLookup):
+        lookups.parse_filter(text)
+
+
+def test_compile_order():
+    assert lookups.compile_order(lookups.parse_order('-created_at,-id'), ORDERS) == ['-created_at', '-id']
+    with pytest.raises(lookups.InvalidLookup):
+        lookups.compile_order(lookups.parse_order('title'), ORDERS)
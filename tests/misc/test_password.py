@@ -0,0 +1,51 @@
+import asyncio
+import time
+
+import pytest
+
+from misc import password
+
+
+@pytest.fixture
+def pool():
+    instance = password.HashPool(workers=1, queue_size=1)
+    yield instance
+    instance.close()
+
+
+@pytest.mark.asyncio
+async def test_hash_verify(pool):
+    pass_hash = await password.get_password_hash(pool, 'password')
+
+    assert await password.verify_password(pool, 'password', pass_hash) == (True, None)
+    assert await password.verify_password(pool, 'wrong_password', pass_hash) == (False, None)
+
+
+@pytest.mark.asyncio
+async def test_pool_busy(pool):
+    running = [asyncio.ensure_future(pool.run(time.sleep, 0.5)) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert pool.pending == 2
+
+    with pytest.raises(password.PoolBusy):
+        await pool.run(time.sleep, 0)
+
+    await asyncio.gather(*running)
+    assert pool.pending == 0
+    assert await pool.run(abs, -1) == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics(pool):
+    await pool.run(time.sleep, 0)
+    hashed, waited = seconds(password.HASH_SECONDS), seconds(password.WAIT_SECONDS)
+
+    await asyncio.gather(pool.run(time.sleep, 0.2), pool.run(time.sleep, 0.2))
+
+    # one worker: the second call waits for the first, the wait is not hash time
+    assert 0.4 <= seconds(password.HASH_SECONDS) - hashed < 0.6
+    assert 0.15 <= seconds(password.WAIT_SECONDS) - waited < 0.4
+
+
+def seconds(histogram) -> float:
+    return sum(value[-1] for _, value in histogram.snapshot())
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from misc import tokens
+
+SECRET = 'test_secret'
+
+
+def test_sign_verify():
+    token = tokens.sign(42, 0, SECRET)
+
+    assert tokens.is_signed(token)
+    assert tokens.verify(token, SECRET, tokens.RevocationList()) == 42
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        '',
+        'garbage',
+        'garbage.garbage',
+        'x.é',
+        'é.é',
+        '.',
+    ])
+def test_verify_invalid(token):
+    assert tokens.verify(token, SECRET, tokens.RevocationList()) is None
+
+
+def test_verify_wrong_secret():
+    assert tokens.verify(tokens.sign(42, 0, SECRET), 'other_secret', tokens.RevocationList()) is None
+
+
+def test_verify_tampered():
+    payload, _, token_signature = tokens.sign(42, 0, SECRET).partition('.')
+    other_payload = tokens.sign(43, 0, SECRET).partition('.')[0]
+
+    assert tokens.verify(f'{other_payload}.{token_signature}', SECRET, tokens.RevocationList()) is None
+
+
+def test_verify_expired(monkeypatch):
+    token = tokens.sign(42, 0, SECRET, ttl=10)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+
+    assert tokens.verify(token, SECRET, tokens.RevocationList()) is None
+
+
+def test_verify_revoked():
+    revocations = tokens.RevocationList()
+    old_token = tokens.sign(42, 0, SECRET)
+    revocations._epochs[42] = 1
+    new_token = tokens.sign(42, revocations.epoch(42), SECRET)
+
+    assert tokens.verify(old_token, SECRET, revocations) is None
+    assert tokens.verify(new_token, SECRET, revocations) == 42
+    assert tokens.verify(tokens.sign(43, 0, SECRET), SECRET, revocations) == 43
@@ -0,0 +1,32 @@
+"""
+Moves likes from legacy `post_{id}` JSON blobs into the likes sorted sets.
+
+    python -m tools.migrate_likes --config etc/config.json
+"""
+import argparse
+import asyncio
+import logging
+
+from misc import ctrl, likes, redis
+import misc.logging
+
+logger = logging.getLogger(__name__)
+
+
+async def migrate(config: dict):
+    conn = await redis.init(config['redis'])
+    try:
+        migrated = await likes.migrate_legacy(conn)
+        logger.info(f'Migrated likes of {migrated} posts')
+    finally:
+        await redis.close(conn)
+
+
+def main(args, config: dict):
+    asyncio.run(migrate(config))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', required=True, help='path to service config')
+    ctrl.main_with_parses(parser, main)
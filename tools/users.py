@@ -0,0 +1,49 @@
+"""
+Disables, enables or renames a user. Cached snapshots of the user are
+dropped in every running worker.
+
+    python -m tools.users --config etc/config.json disable 42
+    python -m tools.users --config etc/config.json rename 42 new_name
+"""
+import argparse
+import asyncio
+import logging
+
+from misc import ctrl, db, redis, users
+import misc.logging
+
+logger = logging.getLogger(__name__)
+
+
+async def change(config: dict, user_id: int, data: dict):
+    db_pool = await db.init(config['db'])
+    conn = await redis.init(config['redis'])
+    try:
+        user = await users.update(user_id, data, users.init_cache({}), db.LazyConnection(db_pool), conn)
+        if user is None:
+            logger.error(f'User {user_id} not found')
+        else:
+            logger.info(f'User {user_id} changed: {user}')
+    finally:
+        await redis.close(conn)
+        await db.close(db_pool)
+
+
+def main(args, config: dict):
+    if args.command == 'rename':
+        data = {'name': args.name}
+    else:
+        data = {'en': args.command == 'enable'}
+    asyncio.run(change(config, args.user_id, data))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', required=True, help='path to service config')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command in ('disable', 'enable'):
+        commands.add_parser(command).add_argument('user_id', type=int)
+    rename = commands.add_parser('rename')
+    rename.add_argument('user_id', type=int)
+    rename.add_argument('name')
+    ctrl.main_with_parses(parser, main)